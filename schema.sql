@@ -37,4 +37,33 @@ CREATE TABLE list (
     status TEXT NOT NULL DEFAULT 'Watching',
     times_watched INT NOT NULL DEFAULT 0,
     UNIQUE (user_id, anime_id)
-);
\ No newline at end of file
+);
+CREATE TABLE user_stats (
+    user_id INT PRIMARY KEY REFERENCES users,
+    total INT NOT NULL DEFAULT 0,
+    completed INT NOT NULL DEFAULT 0,
+    watching INT NOT NULL DEFAULT 0,
+    on_hold INT NOT NULL DEFAULT 0,
+    dropped INT NOT NULL DEFAULT 0,
+    plan_to_watch INT NOT NULL DEFAULT 0
+);
+CREATE TABLE user_tag_stats (
+    user_id INT REFERENCES users NOT NULL,
+    tag TEXT NOT NULL,
+    count INT NOT NULL DEFAULT 0,
+    score_sum INT NOT NULL DEFAULT 0,
+    score_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, tag)
+);
+CREATE TABLE anime_stats (
+    anime_id INT PRIMARY KEY REFERENCES anime,
+    list_count INT NOT NULL DEFAULT 0,
+    score_sum INT NOT NULL DEFAULT 0,
+    score_count INT NOT NULL DEFAULT 0
+);
+CREATE TABLE catalog (
+    generation TEXT NOT NULL
+);
+CREATE INDEX list_anime_id_idx ON list (anime_id);
+CREATE INDEX tags_anime_id_idx ON tags (anime_id);
+CREATE UNIQUE INDEX users_username_lower_idx ON users (LOWER(username));
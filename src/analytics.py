@@ -0,0 +1,131 @@
+import argparse
+import os
+import sys
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Reports over the Parquet snapshot written by export_snapshot.py. The files
+# are memory mapped and only the needed columns are read, so reports don't need
+# the database. Every report returns a list of row dicts.
+
+SNAPSHOT_DIR = "../snapshot"
+
+
+def load(table: str, columns: list, directory: str = SNAPSHOT_DIR) -> pa.Table:
+    return pq.read_table(
+        os.path.join(directory, f"{table}.parquet"), columns=columns, memory_map=True
+    )
+
+
+def with_titles(table: pa.Table, directory: str = SNAPSHOT_DIR) -> pa.Table:
+    anime = load("anime", ["id", "title"], directory).rename_columns(
+        ["anime_id", "title"]
+    )
+    return table.join(anime, "anime_id")
+
+
+def score_distribution(directory: str = SNAPSHOT_DIR) -> list:
+    scores = load("list", ["score"], directory).column("score")
+    counts = pc.value_counts(scores.drop_null())
+    return sorted(
+        (
+            {"score": score, "count": count}
+            for score, count in zip(
+                counts.field("values").to_pylist(), counts.field("counts").to_pylist()
+            )
+        ),
+        key=lambda row: row["score"],
+    )
+
+
+def tag_scores(directory: str = SNAPSHOT_DIR, min_scores: int = 100) -> list:
+    entries = load("list", ["anime_id", "score"], directory)
+    tags = load("tags", ["anime_id", "tag"], directory)
+    scores = (
+        tags.join(entries, "anime_id")
+        .group_by("tag")
+        .aggregate([("score", "mean"), ("score", "count")])
+        .select(["tag", "score_mean", "score_count"])
+        .rename_columns(["tag", "score", "scores"])
+    )
+    scores = scores.filter(pc.greater_equal(scores["scores"], min_scores))
+    return scores.sort_by([("score", "descending")]).to_pylist()
+
+
+def tag_popularity(directory: str = SNAPSHOT_DIR) -> list:
+    entries = load("list", ["user_id", "anime_id"], directory)
+    tags = load("tags", ["anime_id", "tag"], directory)
+    popularity = (
+        tags.join(entries, "anime_id")
+        .group_by("tag")
+        .aggregate([("user_id", "count"), ("user_id", "count_distinct")])
+        .select(["tag", "user_id_count", "user_id_count_distinct"])
+        .rename_columns(["tag", "entries", "users"])
+    )
+    return popularity.sort_by([("entries", "descending")]).to_pylist()
+
+
+def completion_rates(directory: str = SNAPSHOT_DIR, min_entries: int = 100) -> list:
+    entries = load("list", ["anime_id", "status"], directory)
+    entries = entries.append_column(
+        "completed", pc.cast(pc.equal(entries["status"], "Completed"), pa.float64())
+    ).append_column(
+        "dropped", pc.cast(pc.equal(entries["status"], "Dropped"), pa.float64())
+    )
+    rates = (
+        entries.group_by("anime_id")
+        .aggregate([("completed", "mean"), ("dropped", "mean"), ("anime_id", "count")])
+        .select(["anime_id", "completed_mean", "dropped_mean", "anime_id_count"])
+        .rename_columns(["anime_id", "completed", "dropped", "entries"])
+    )
+    rates = rates.filter(pc.greater_equal(rates["entries"], min_entries))
+    return (
+        with_titles(rates, directory).sort_by([("completed", "descending")]).to_pylist()
+    )
+
+
+REPORTS = {
+    "score-distribution": score_distribution,
+    "tag-scores": tag_scores,
+    "tag-popularity": tag_popularity,
+    "completion-rates": completion_rates,
+}
+
+
+def print_rows(rows: list) -> None:
+    if not rows:
+        print("No rows")
+        return
+    columns = list(rows[0])
+    widths = [
+        max(len(column), *(len(format_value(row[column])) for row in rows))
+        for column in columns
+    ]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print(
+            "  ".join(
+                format_value(row[column]).ljust(width)
+                for column, width in zip(columns, widths)
+            )
+        )
+
+
+def format_value(value) -> str:
+    return f"{value:.2f}" if isinstance(value, float) else str(value)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("report", choices=REPORTS)
+    parser.add_argument("--directory", default=SNAPSHOT_DIR)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+    print_rows(REPORTS[args.report](args.directory)[: args.limit])
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
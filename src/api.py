@@ -0,0 +1,311 @@
+import base64
+import binascii
+import json
+from os import getenv
+from typing import Optional
+
+from asyncpg.exceptions import QueryCanceledError
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+import query_timeout
+from database import database_url
+from repositories import (
+    anime_repository,
+    list_repository,
+    relation_repository,
+    tag_repository,
+    user_repository,
+)
+
+# JSON versions of the catalog and list pages, served on the event loop of the
+# web workers (see asgi.py) so slow clients and queries don't hold the threads
+# that render pages. The queries are the SQL of the repositories, run through
+# asyncpg with a separate connection pool of API_POOL_SIZE connections.
+#
+# Paginated endpoints return {"data": [...], "next": cursor}, and the cursor is
+# passed back as ?cursor= to get the next page. ?fields=id,title limits the
+# fields of every item.
+
+engine = create_async_engine(
+    database_url().replace("postgresql://", "postgresql+asyncpg://", 1),
+    pool_size=int(getenv("API_POOL_SIZE", "10")),
+    max_overflow=0,
+)
+
+ANIME_PAGE_SIZE = 50
+ANIME_FIELDS = ("id", "title", "episodes", "thumbnail", "score")
+ANIME_DETAIL_FIELDS = (
+    "id",
+    "title",
+    "link",
+    "episodes",
+    "score",
+    "picture",
+    "tags",
+    "related",
+)
+LIST_FIELDS = (
+    "id",
+    "title",
+    "thumbnail",
+    "episodes",
+    "episodes_watched",
+    "status",
+    "score",
+)
+TAG_FIELDS = ("tag", "anime_count", "score")
+
+
+async def fetch_many(queries: list, timeout: int) -> list:
+    # The queries run one after another in a transaction on a single pooled
+    # connection, and a skipped query (None) returns no rows
+    results = []
+    async with engine.connect() as connection:
+        async with connection.begin():
+            # SET LOCAL lasts until the end of the transaction
+            await connection.execute(
+                text(f"SET LOCAL statement_timeout = {int(timeout)}")
+            )
+            for query in queries:
+                if query is None:
+                    results.append([])
+                    continue
+                try:
+                    result = await connection.execute(text(query[0]), query[1])
+                except DBAPIError as error:
+                    if not isinstance(error.orig.__cause__, QueryCanceledError):
+                        raise
+                    raise query_timeout.QueryTimeout() from error
+                results.append(result.fetchall())
+    return results
+
+
+async def fetch(sql: str, parameters: dict, timeout: int) -> list:
+    return (await fetch_many([(sql, parameters)], timeout))[0]
+
+
+async def handle_error(_: Request, error: HTTPException) -> JSONResponse:
+    return JSONResponse({"error": error.detail}, status_code=error.status_code)
+
+
+async def handle_timeout(_: Request, __: query_timeout.QueryTimeout) -> JSONResponse:
+    return JSONResponse(
+        {"error": "The request took too long, try again later"},
+        status_code=503,
+        headers={"Retry-After": str(query_timeout.RETRY_AFTER_SECONDS)},
+    )
+
+
+def encode_cursor(position: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode()
+
+
+def decode_cursor(request: Request) -> dict:
+    if "cursor" not in request.query_params:
+        return {}
+    try:
+        position = json.loads(base64.urlsafe_b64decode(request.query_params["cursor"]))
+    except (binascii.Error, ValueError) as error:
+        raise HTTPException(400, "Invalid cursor") from error
+    if not isinstance(position, dict):
+        raise HTTPException(400, "Invalid cursor")
+    return position
+
+
+def get_fields(request: Request, allowed: tuple) -> tuple:
+    if "fields" not in request.query_params:
+        return allowed
+    fields = tuple(
+        field for field in request.query_params["fields"].split(",") if field
+    )
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise HTTPException(400, f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def select_fields(item: dict, fields: tuple) -> dict:
+    return {field: item[field] for field in fields}
+
+
+def to_number(score) -> Optional[float]:
+    return None if score is None else float(score)
+
+
+# /api/v1/anime
+async def anime_list_get(request: Request) -> JSONResponse:
+    fields = get_fields(request, ANIME_FIELDS)
+    query = request.query_params.get("query", "")
+    tags = [tag.lower() for tag in request.query_params.getlist("tag") if tag]
+    # The search index lives in the web workers, so only a single tag is supported
+    if len(tags) > 1:
+        raise HTTPException(400, "Filtering by more than one tag is not supported")
+    offset = decode_cursor(request).get("offset", 0)
+    if not isinstance(offset, int) or offset < 0:
+        raise HTTPException(400, "Invalid cursor")
+
+    rows = await fetch(
+        anime_repository.TOP_ANIME_TAG_SQL if tags else anime_repository.TOP_ANIME_SQL,
+        {
+            "offset": offset,
+            "query": f"%{query}%",
+            "tag": tags[0] if tags else "",
+            "show_hidden": False,
+        },
+        3000,
+    )
+    top_anime = [
+        {
+            "id": row[0],
+            "thumbnail": row[1],
+            "title": row[2],
+            "episodes": row[3],
+            "score": to_number(row[4]),
+        }
+        for row in rows
+    ]
+
+    return JSONResponse(
+        {
+            "data": [select_fields(anime, fields) for anime in top_anime],
+            "next": encode_cursor({"offset": offset + ANIME_PAGE_SIZE})
+            if len(top_anime) == ANIME_PAGE_SIZE
+            else None,
+        }
+    )
+
+
+# /api/v1/anime/id
+async def anime_get(request: Request) -> JSONResponse:
+    fields = get_fields(request, ANIME_DETAIL_FIELDS)
+    anime_id = request.path_params["anime_id"]
+
+    metadata, score, tags, related = await fetch_many(
+        [
+            (anime_repository.ANIME_METADATA_SQL, {"id": anime_id}),
+            (anime_repository.SCORE_SQL, {"id": anime_id}),
+            (tag_repository.TAGS_SQL, {"anime_id": anime_id})
+            if "tags" in fields
+            else None,
+            (relation_repository.ANIME_RELATED_SQL, {"anime_id": anime_id})
+            if "related" in fields
+            else None,
+        ],
+        1000,
+    )
+    if not metadata:
+        raise HTTPException(404, "No anime found")
+
+    anime = {
+        "id": metadata[0][0],
+        "title": metadata[0][1],
+        "link": metadata[0][2],
+        "episodes": metadata[0][3],
+        "score": to_number(score[0][0]) if score else None,
+        "picture": metadata[0][4],
+        "tags": [row[0] for row in tags],
+        "related": [{"id": row[0], "title": row[1]} for row in related],
+    }
+    return JSONResponse(select_fields(anime, fields))
+
+
+# /api/v1/users/username/list
+async def list_get(request: Request) -> JSONResponse:
+    fields = get_fields(request, LIST_FIELDS)
+    tag = request.query_params.get("tag", "")
+    status = request.query_params.get("status", "All")
+    sort = request.query_params.get("sort", "title")
+    if sort not in list_repository.LIST_SORTS:
+        raise HTTPException(400, f"Unknown sort: {sort}")
+    after = decode_cursor(request).get("after")
+    if after is not None and not isinstance(after, int):
+        raise HTTPException(400, "Invalid cursor")
+
+    user = await fetch(
+        user_repository.USER_DATA_SQL,
+        {"username": request.path_params["username"]},
+        1000,
+    )
+    if not user:
+        raise HTTPException(404, "No user found")
+
+    rows = await fetch(
+        list_repository.list_data_sql(sort, tag),
+        {
+            "user_id": user[0][0],
+            "status": status,
+            "tag": tag,
+            "after": after,
+            "limit": list_repository.LIST_PAGE_SIZE + 1,
+        },
+        2000,
+    )
+    list_data = [
+        {
+            "id": row[0],
+            "thumbnail": row[1],
+            "title": row[2],
+            "episodes_watched": row[3],
+            "episodes": row[4],
+            "status": row[5],
+            "score": row[6],
+        }
+        for row in rows[: list_repository.LIST_PAGE_SIZE]
+    ]
+
+    return JSONResponse(
+        {
+            "data": [select_fields(anime, fields) for anime in list_data],
+            "next": encode_cursor({"after": list_data[-1]["id"]})
+            if len(rows) > list_repository.LIST_PAGE_SIZE
+            else None,
+        }
+    )
+
+
+# /api/v1/tags
+async def tags_get(request: Request) -> JSONResponse:
+    fields = get_fields(request, TAG_FIELDS)
+    counts, popular = await fetch_many(
+        [(tag_repository.TAG_COUNTS_SQL, {}), (tag_repository.POPULAR_TAGS_SQL, {})],
+        3000,
+    )
+    scores = dict(popular)
+    return JSONResponse(
+        [
+            select_fields(
+                {"tag": tag, "anime_count": count, "score": to_number(scores.get(tag))},
+                fields,
+            )
+            for tag, count in counts
+        ]
+    )
+
+
+async def dispose_engine() -> None:
+    await engine.dispose()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/v1/anime", anime_list_get),
+        Route("/api/v1/anime/{anime_id:int}", anime_get),
+        Route("/api/v1/users/{username:path}/list", list_get),
+        Route("/api/v1/tags", tags_get),
+    ],
+    middleware=[Middleware(GZipMiddleware, minimum_size=1024)],
+    exception_handlers={
+        HTTPException: handle_error,
+        query_timeout.QueryTimeout: handle_timeout,
+    },
+    on_shutdown=[dispose_engine],
+)
@@ -1,14 +1,70 @@
 # pylint: skip-file
 from os import getenv
 
+import click
 from flask import Flask
 
-app = Flask(__name__)
-app.secret_key = getenv("SECRET_KEY")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["MAX_CONTENT_LENGTH"] = 1024**2
+import fragment_cache
+import profiling
+import query_timeout
+import request_memo
+import routes
+import search_index
+import static_assets
+from database import database, database_url
 
-if getenv("INIT") == "True":
-    import init_db
-else:
-    import routes
+
+def create_app() -> Flask:
+    app = Flask(__name__)
+    app.secret_key = getenv("SECRET_KEY")
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url()
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["MAX_CONTENT_LENGTH"] = 1024**2
+    database.init_app(app)
+    app.register_blueprint(routes.blueprint)
+    app.after_request(request_memo.log_saved_queries)
+    profiling.init_app(app)
+    static_assets.init_app(app)
+    fragment_cache.init_app(app)
+    query_timeout.init_app(app)
+    register_commands(app)
+
+    if search_index.enabled:
+        with app.app_context():
+            search_index.get_index()
+            # Don't share connections with forked workers when using --preload
+            database.session.remove()
+            database.get_engine().dispose()
+
+    return app
+
+
+def register_commands(app: Flask) -> None:
+    # Initialization code is only imported when the command is run
+    @app.cli.command("init-db")
+    @click.option("--workers", type=int, help="Transform processes, default all cores")
+    @click.option("--chunk-size", default=1000, help="Records per transform batch")
+    def init_db_command(workers: int, chunk_size: int) -> None:
+        import init_db
+
+        init_db.import_data(workers, chunk_size)
+
+    @app.cli.command("rebuild-stats")
+    def rebuild_stats_command() -> None:
+        from repositories import stats_repository
+
+        print("Rebuilding profile statistics from list data")
+        stats_repository.rebuild_stats()
+        print("Done!")
+
+    @app.cli.command("partition-list")
+    @click.option("--partitions", default=16, help="Number of hash partitions")
+    def partition_list_command(partitions: int) -> None:
+        from repositories import initialization_repository
+
+        if initialization_repository.is_list_partitioned():
+            print("The list table is already partitioned")
+            return
+        print(f"Moving list entries to {partitions} partitions")
+        initialization_repository.partition_list(partitions)
+        print("Done!")
@@ -0,0 +1,26 @@
+from os import getenv
+
+from anyio import to_thread
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.types import Receive, Scope, Send
+
+import api
+from app import create_app
+
+# The website and the JSON API served by the same web workers, so the API is
+# reachable wherever the website is. Requests under /api/ are answered on the
+# event loop, and pages are rendered by Flask in WEB_THREADS worker threads,
+# by default one so a worker renders one page at a time like a sync worker.
+
+web = WSGIMiddleware(create_app())
+web_threads = int(getenv("WEB_THREADS", "1"))
+
+
+async def app(scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] == "lifespan":
+        to_thread.current_default_thread_limiter().total_tokens = web_threads
+    if scope["type"] == "http" and not scope["path"].startswith("/api/"):
+        await web(scope, receive, send)
+    else:
+        # Lifespan events dispose of the API's connection pool on shutdown
+        await api.app(scope, receive, send)
@@ -0,0 +1,154 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+# Grows the list table step by step and measures the per-user queries at every
+# size, once with the plain table and once partitioned by user_id. The database
+# in BENCHMARK_DATABASE_URL is emptied, so it must not be the production
+# database.
+if not os.getenv("BENCHMARK_DATABASE_URL"):
+    print("Set BENCHMARK_DATABASE_URL to a scratch database")
+    sys.exit(1)
+os.environ["DATABASE_URL"] = os.environ["BENCHMARK_DATABASE_URL"]
+
+# pylint: disable=wrong-import-position
+from flask import g, session
+
+from app import create_app
+from database import database
+from repositories import initialization_repository, list_repository, stats_repository
+
+ANIME_COUNT = 20000
+LIST_SIZE = 200
+SAMPLE_USERS = 200
+
+QUERIES = {
+    "get_list_data": lambda user_id: list_repository.get_list_data(
+        user_id, "All", "", "title", None, list_repository.LIST_PAGE_SIZE + 1
+    ),
+    "get_list_data_status": lambda user_id: list_repository.get_list_data(
+        user_id, "Completed", "", "score", None, list_repository.LIST_PAGE_SIZE + 1
+    ),
+    "get_list_count": lambda user_id: list_repository.get_list_count(
+        user_id, "Watching", ""
+    ),
+    "get_user_anime_data": lambda user_id: list_repository.get_user_anime_data(
+        user_id, anime_in_list(user_id, 0)
+    ),
+    "set_score": lambda user_id: list_repository.set_score(
+        user_id, anime_in_list(user_id, 1), random.randint(1, 10)
+    ),
+    "get_counts": stats_repository.get_counts,
+}
+
+
+def anime_in_list(user_id: int, index: int) -> int:
+    # Same formula as the generated lists
+    return (user_id * 7919 + index * 104729) % ANIME_COUNT + 1
+
+
+def create_tables(partitions: int) -> None:
+    initialization_repository.init_tables()
+    sql = """
+        INSERT INTO anime (title, episodes, link, picture, thumbnail, hidden)
+        SELECT 'Anime ' || i, 12, 'https://myanimelist.net/anime/' || i, '', '', false
+        FROM generate_series(1, :count) i
+    """
+    database.session.execute(sql, {"count": ANIME_COUNT})
+    initialization_repository.commit()
+    if partitions:
+        initialization_repository.partition_list(partitions)
+
+
+def add_users(first: int, last: int) -> None:
+    sql = """
+        INSERT INTO users (id, username, password)
+        SELECT i, 'user' || i, '-' FROM generate_series(:first, :last) i
+    """
+    database.session.execute(sql, {"first": first, "last": last})
+    sql = """
+        INSERT INTO list (user_id, anime_id, episodes, score, status, times_watched)
+        SELECT u, (u * 7919 + j * 104729) % :anime_count + 1, j % 13,
+            CASE WHEN j % 3 = 0 THEN NULL ELSE j % 10 + 1 END,
+            (ARRAY['Completed', 'Watching', 'On-Hold', 'Dropped', 'Plan to Watch'])
+                [j % 5 + 1],
+            j % 4
+        FROM generate_series(:first, :last) u, generate_series(0, :list_size - 1) j
+    """
+    database.session.execute(
+        sql,
+        {
+            "first": first,
+            "last": last,
+            "anime_count": ANIME_COUNT,
+            "list_size": LIST_SIZE,
+        },
+    )
+    # get_counts reads user_stats, which is filled from the list
+    stats_repository.rebuild_stats()
+    database.session.execute("ANALYZE")
+    initialization_repository.commit()
+
+
+def measure(user_count: int) -> dict:
+    random.seed(0)
+    user_ids = [random.randint(1, user_count) for _ in range(SAMPLE_USERS)]
+    timings = {}
+    for name, query in QUERIES.items():
+        times = []
+        for user_id in user_ids:
+            g.pop("memo", None)
+            session["user_id"] = user_id
+            start = time.perf_counter()
+            query(user_id)
+            times.append(time.perf_counter() - start)
+        timings[name] = statistics.median(times) * 1000
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--partitions", type=int, default=16)
+    parser.add_argument(
+        "--steps",
+        default="1,2,4,8",
+        help="comma separated list sizes in millions of rows",
+    )
+    args = parser.parse_args()
+    steps = [int(float(step) * 1e6) // LIST_SIZE for step in args.steps.split(",")]
+
+    app = create_app()
+    app.config["RESPONSE_CACHE"] = False
+    results = {}
+    with app.test_request_context():
+        for layout, partitions in (("plain", 0), ("partitioned", args.partitions)):
+            create_tables(partitions)
+            user_count = 0
+            for step in steps:
+                start = time.perf_counter()
+                add_users(user_count + 1, step)
+                user_count = step
+                print(
+                    f"{layout}: {user_count * LIST_SIZE:,} rows "
+                    f"(loaded in {time.perf_counter() - start:.1f} s)"
+                )
+                results[layout, user_count] = measure(user_count)
+
+    print()
+    print(f"Median ms per query, {SAMPLE_USERS} users sampled at every size")
+    header = f"{'rows':>12} {'layout':<12}" + "".join(f"{name:>22}" for name in QUERIES)
+    print(header)
+    for (layout, user_count), timings in sorted(
+        results.items(), key=lambda item: (item[0][1], item[0][0])
+    ):
+        print(
+            f"{user_count * LIST_SIZE:>12,} {layout:<12}"
+            + "".join(f"{timings[name]:>22.2f}" for name in QUERIES)
+        )
+    sys.exit(0)
+
+
+main()
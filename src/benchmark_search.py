@@ -0,0 +1,49 @@
+import random
+import sys
+import time
+
+import search_index
+from app import create_app
+from repositories import anime_repository
+
+
+def benchmark(name: str, search, queries: list) -> None:
+    start = time.perf_counter()
+    for query in queries:
+        search(query)
+    elapsed = time.perf_counter() - start
+    print(f"{name}: {elapsed / len(queries) * 1e6:.1f} µs per query")
+
+
+def main() -> None:
+    search_index.enabled = True
+    app = create_app()
+    with app.test_request_context():
+        start = time.perf_counter()
+        index = search_index.get_index()
+        print(
+            f"Loaded {len(index.records)} anime in {time.perf_counter() - start:.2f} s"
+        )
+        print(f"Index memory usage: {index.memory_usage() / 1024**2:.1f} MiB")
+
+        random.seed(0)
+        queries = []
+        for record in random.sample(index.records, min(200, len(index.records))):
+            start = random.randrange(max(1, len(record.title) - 4))
+            queries.append(record.title[start : start + random.randint(3, 8)])
+
+        benchmark(
+            "Search index",
+            lambda query: index.ids(index.filter(query, [], [], [], False)),
+            queries,
+        )
+        benchmark(
+            "Facet counts",
+            lambda query: index.facets(index.filter(query, [], [], [], False), []),
+            queries,
+        )
+        benchmark("SQL", lambda query: anime_repository.anime_count(query, ""), queries)
+    sys.exit(0)
+
+
+main()
@@ -0,0 +1,41 @@
+import statistics
+import subprocess
+import sys
+
+# Every run is a fresh interpreter, like a newly started worker
+STARTUP_CODE = """
+import time
+start = time.perf_counter()
+from app import create_app
+app = create_app()
+created = time.perf_counter()
+app.test_client().get("/")
+print(created - start, time.perf_counter() - start)
+"""
+
+
+def main() -> None:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    create_times = []
+    first_request_times = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_CODE],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.split()
+        create_times.append(float(output[0]))
+        first_request_times.append(float(output[1]))
+
+    for name, times in (
+        ("Import and create app", create_times),
+        ("Until first response", first_request_times),
+    ):
+        print(
+            f"{name}: median {statistics.median(times) * 1000:.1f} ms, "
+            f"min {min(times) * 1000:.1f} ms ({runs} runs)"
+        )
+
+
+main()
@@ -0,0 +1,293 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+# Loads synthetic data into a scratch database, runs EXPLAIN (ANALYZE) for the
+# queries of every repository function and compares the plans with the recorded
+# baselines in query_plans.json. The database in PLAN_CHECK_DATABASE_URL is
+# dropped and recreated, so it must not be the production database.
+if not os.getenv("PLAN_CHECK_DATABASE_URL"):
+    print("Set PLAN_CHECK_DATABASE_URL to a scratch database")
+    sys.exit(1)
+os.environ["DATABASE_URL"] = os.environ["PLAN_CHECK_DATABASE_URL"]
+
+# pylint: disable=wrong-import-position
+from flask import g, session
+from sqlalchemy import event
+
+import init_db
+from app import create_app
+from database import database
+from repositories import (
+    anime_repository,
+    initialization_repository,
+    list_repository,
+    relation_repository,
+    stats_repository,
+    tag_repository,
+    user_repository,
+)
+
+BASELINE_FILE = "../query_plans.json"
+TAGS = [f"tag {i}" for i in range(300)]
+STATUSES = ["Completed", "Watching", "On-Hold", "Dropped", "Plan to Watch"]
+EXPLAINED_STATEMENTS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+def seed(anime_count: int, user_count: int) -> None:
+    random.seed(0)
+    initialization_repository.init_tables()
+
+    anime_rows = []
+    synonym_rows = []
+    tag_rows = []
+    relation_rows = []
+    for anime_id in range(1, anime_count + 1):
+        title = " ".join(random.choices(TAGS, k=3)).title() + f" {anime_id}"
+        anime_rows.append(
+            (
+                anime_id,
+                title,
+                random.randint(1, 100),
+                f"https://myanimelist.net/anime/{anime_id}",
+                "",
+                "",
+                random.random() < 0.05,
+            )
+        )
+        synonym_rows.extend(
+            (anime_id, f"{title} synonym {i}") for i in range(random.randint(0, 3))
+        )
+        tag_rows.extend(
+            (anime_id, tag) for tag in random.sample(TAGS, random.randint(0, 8))
+        )
+        relation_rows.extend(
+            (anime_id, random.randint(1, anime_count))
+            for _ in range(random.randint(0, 3))
+        )
+
+    user_rows = [(i, f"user{i}", "-") for i in range(1, user_count + 1)]
+    list_rows = []
+    for user_id in range(1, user_count + 1):
+        # The first user has a very large list
+        size = 10000 if user_id == 1 else random.randint(0, 200)
+        for anime_id in random.sample(
+            range(1, anime_count + 1), min(size, anime_count)
+        ):
+            list_rows.append(
+                (
+                    user_id,
+                    anime_id,
+                    random.randint(0, 12),
+                    random.randint(1, 10) if random.random() < 0.7 else None,
+                    random.choice(STATUSES),
+                    random.randint(0, 3),
+                )
+            )
+
+    copy_rows = initialization_repository.copy_rows
+    copy_rows("anime", init_db.ANIME_COLUMNS, init_db.to_csv(anime_rows))
+    copy_rows("synonyms", ("anime_id", "synonym"), init_db.to_csv(synonym_rows))
+    copy_rows("tags", ("anime_id", "tag"), init_db.to_csv(tag_rows))
+    copy_rows("relations", ("anime_id", "related_id"), init_db.to_csv(relation_rows))
+    copy_rows("users", ("id", "username", "password"), init_db.to_csv(user_rows))
+    copy_rows(
+        "list",
+        ("user_id", "anime_id", "episodes", "score", "status", "times_watched"),
+        # to_csv quotes None as "", which COPY reads as an empty string, not NULL
+        "".join(
+            ",".join("" if value is None else str(value) for value in row) + "\n"
+            for row in list_rows
+        ),
+    )
+    initialization_repository.reset_id_sequence("anime")
+    initialization_repository.reset_id_sequence("users")
+    initialization_repository.set_import_generation()
+    initialization_repository.commit()
+    stats_repository.rebuild_stats()
+    # A 300000 row sample covers every table, so the statistics and the plans
+    # don't change between runs
+    database.session.execute("SET LOCAL default_statistics_target = 1000")
+    database.session.execute("ANALYZE")
+    database.session.commit()
+
+
+SCENARIOS = {
+    "anime_count": lambda: anime_repository.anime_count("tag 1", ""),
+    "anime_count_tag": lambda: anime_repository.anime_count("", "tag 2"),
+    "get_anime": lambda: anime_repository.get_anime(100),
+    "get_top_anime": lambda: anime_repository.get_top_anime(0, "", ""),
+    "get_top_anime_query": lambda: anime_repository.get_top_anime(50, "tag 1", ""),
+    "get_top_anime_tag": lambda: anime_repository.get_top_anime(0, "", "tag 2"),
+    "get_top_anime_by_ids": lambda: anime_repository.get_top_anime_by_ids(
+        0, list(range(1, 2000, 3))
+    ),
+    "autocomplete": lambda: anime_repository.autocomplete("tag 12"),
+    "get_anime_id_and_episodes": lambda: anime_repository.get_anime_id_and_episodes(
+        "https://myanimelist.net/anime/200"
+    ),
+    "get_list_data": lambda: list_repository.get_list_data(
+        1, "All", "", "title", None, 101
+    ),
+    "get_list_data_page": lambda: list_repository.get_list_data(
+        1, "Completed", "", "score", 500, 101
+    ),
+    "get_list_data_tag": lambda: list_repository.get_list_data(
+        1, "All", "tag 3", "progress", None, 101
+    ),
+    "get_list_count": lambda: list_repository.get_list_count(1, "All", "tag 3"),
+    "get_user_anime_data": lambda: list_repository.get_user_anime_data(2, 100),
+    "iterate_export_data": lambda: list(list_repository.iterate_export_data(1)),
+    # Anime 1 and 2 aren't in the seeded list of user 2, so the writes change the
+    # entry added here, which is removed last
+    "add_to_list": lambda: list_repository.add_to_list(2, 1),
+    "import_to_list": lambda: list_repository.import_to_list(
+        2,
+        {
+            "anime_id": 2,
+            "episodes": 12,
+            "score": 8,
+            "status": "Completed",
+            "times_watched": 1,
+        },
+    ),
+    "set_score": lambda: list_repository.set_score(2, 1, 7),
+    "set_status": lambda: list_repository.set_status(2, 1, "Completed"),
+    "set_times_watched": lambda: list_repository.set_times_watched(2, 1, 2),
+    "add_times_watched": lambda: list_repository.add_times_watched(2, 1, 1),
+    "set_episodes_watched": lambda: list_repository.set_episodes_watched(2, 1, 5),
+    "remove_from_list": lambda: list_repository.remove_from_list(2, 1),
+    "related_anime_count": lambda: relation_repository.related_anime_count(1),
+    "get_related_anime": lambda: relation_repository.get_related_anime(0, 1),
+    "get_anime_related_anime": lambda: relation_repository.get_anime_related_anime(100),
+    "get_tags": lambda: tag_repository.get_tags(100),
+    "get_tag_counts": tag_repository.get_tag_counts,
+    "get_popular_tags": tag_repository.get_popular_tags,
+    "get_counts": lambda: stats_repository.get_counts(1),
+    "get_watched_tags": lambda: stats_repository.get_watched_tags(1),
+    "get_popular_user_tags": lambda: stats_repository.get_popular_tags(1),
+    "get_user_data": lambda: user_repository.get_user_data("user1"),
+    "get_login_data": lambda: user_repository.get_login_data("user2"),
+    "username_taken": lambda: user_repository.username_taken("USER3"),
+    "set_show_hidden": lambda: user_repository.set_show_hidden(True),
+    "add_user": lambda: user_repository.add_user("plan_check", "-"),
+}
+
+
+def plan_shape(plan: dict) -> list:
+    node = plan["Node Type"]
+    for key in ("Relation Name", "Index Name"):
+        if key in plan:
+            node += f" {plan[key]}"
+    return [node, [plan_shape(child) for child in plan.get("Plans", [])]]
+
+
+def explain(cursor, statement: str, parameters: dict) -> dict:
+    # The statement is explained right before it runs, in a savepoint that is
+    # rolled back, so writes see the same data and don't run twice
+    cursor.execute("SAVEPOINT plan_check")
+    cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {statement}", parameters)
+    result = cursor.fetchone()[0][0]
+    cursor.execute("ROLLBACK TO SAVEPOINT plan_check")
+    return {
+        "shape": plan_shape(result["Plan"]),
+        "cost": result["Plan"]["Total Cost"],
+        "time": result["Execution Time"],
+    }
+
+
+def collect_plans() -> dict:
+    plans = {}
+    name = ""
+    count = 0
+
+    def capture(conn, _cursor, statement, parameters, _context, _executemany):
+        nonlocal count
+        if statement.lstrip().upper().startswith(EXPLAINED_STATEMENTS):
+            cursor = conn.connection.cursor()
+            plans[f"{name}.{count}"] = explain(cursor, statement, parameters)
+            cursor.close()
+            count += 1
+
+    event.listen(database.engine, "before_cursor_execute", capture)
+    try:
+        for name, scenario in SCENARIOS.items():
+            count = 0
+            g.pop("memo", None)
+            session["user_id"] = 1
+            session["show_hidden"] = False
+            scenario()
+    finally:
+        event.remove(database.engine, "before_cursor_execute", capture)
+    return plans
+
+
+def compare(
+    plans: dict, baselines: dict, cost_factor: float, time_factor: float
+) -> list:
+    failures = []
+    for name, plan in plans.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            failures.append(f"{name}: no baseline, run with --update")
+            continue
+        if plan["shape"] != baseline["shape"]:
+            failures.append(
+                f"{name}: plan changed\n"
+                f"  baseline: {json.dumps(baseline['shape'])}\n"
+                f"  current:  {json.dumps(plan['shape'])}"
+            )
+        if plan["cost"] > baseline["cost"] * cost_factor:
+            failures.append(
+                f"{name}: cost {plan['cost']:.0f} > baseline {baseline['cost']:.0f}"
+            )
+        # Small absolute slack so fast queries don't fail on timer noise
+        if plan["time"] > baseline["time"] * time_factor + 1:
+            failures.append(
+                f"{name}: {plan['time']:.1f} ms > baseline {baseline['time']:.1f} ms"
+            )
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--update", action="store_true", help="record new baselines")
+    parser.add_argument("--anime", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--cost-factor", type=float, default=1.5)
+    parser.add_argument("--time-factor", type=float, default=3.0)
+    args = parser.parse_args()
+
+    app = create_app()
+    app.config["RESPONSE_CACHE"] = False
+    with app.test_request_context():
+        print(f"Loading {args.anime} anime and {args.users} users")
+        start = time.perf_counter()
+        seed(args.anime, args.users)
+        print(f"Loaded in {time.perf_counter() - start:.1f} s")
+        plans = collect_plans()
+
+    if args.update:
+        with open(BASELINE_FILE, "w", encoding="utf-8") as file:
+            json.dump(plans, file, indent=2, sort_keys=True)
+        print(f"Recorded {len(plans)} query plans")
+        sys.exit(0)
+
+    try:
+        with open(BASELINE_FILE, "r", encoding="utf-8") as file:
+            baselines = json.load(file)
+    except FileNotFoundError:
+        print("No baselines recorded, run with --update")
+        sys.exit(1)
+
+    failures = compare(plans, baselines, args.cost_factor, args.time_factor)
+    for failure in failures:
+        print(failure)
+    print(f"{len(plans)} query plans checked, {len(failures)} regressions")
+    sys.exit(1 if failures else 0)
+
+
+main()
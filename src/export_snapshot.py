@@ -0,0 +1,94 @@
+import argparse
+import os
+import sys
+import time
+
+# Copies the catalog and list tables to Parquet files that the reports in
+# analytics.py read. Set SNAPSHOT_DATABASE_URL to read from a replica instead of
+# the database in DATABASE_URL.
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    print("pyarrow is not installed, install it with poetry install -E analytics")
+    sys.exit(1)
+if os.getenv("SNAPSHOT_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["SNAPSHOT_DATABASE_URL"]
+
+# pylint: disable=wrong-import-position
+from app import create_app
+from repositories import anime_repository, snapshot_repository
+
+SNAPSHOT_TABLES = {
+    "anime": pa.schema(
+        [
+            ("id", pa.int32()),
+            ("title", pa.string()),
+            ("episodes", pa.int32()),
+            ("link", pa.string()),
+            ("hidden", pa.bool_()),
+        ]
+    ),
+    "tags": pa.schema([("anime_id", pa.int32()), ("tag", pa.string())]),
+    "relations": pa.schema([("anime_id", pa.int32()), ("related_id", pa.int32())]),
+    "list": pa.schema(
+        [
+            ("user_id", pa.int32()),
+            ("anime_id", pa.int32()),
+            ("episodes", pa.int32()),
+            ("score", pa.int8()),
+            ("status", pa.string()),
+            ("times_watched", pa.int32()),
+        ]
+    ),
+}
+
+
+def export_table(directory: str, table: str, chunk_size: int) -> int:
+    schema = SNAPSHOT_TABLES[table]
+    path = os.path.join(directory, f"{table}.parquet")
+    temp_path = f"{path}.tmp"
+    row_count = 0
+    # Every chunk is written as its own row group, so memory use stays constant
+    with pq.ParquetWriter(temp_path, schema, compression="zstd") as writer:
+        for rows in snapshot_repository.iterate_table(
+            table, tuple(schema.names), chunk_size
+        ):
+            columns = list(zip(*rows))
+            writer.write_batch(
+                pa.record_batch(
+                    [
+                        pa.array(column, type=field.type)
+                        for column, field in zip(columns, schema)
+                    ],
+                    schema=schema,
+                )
+            )
+            row_count += len(rows)
+    os.replace(temp_path, path)
+    return row_count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--directory", default="../snapshot")
+    parser.add_argument("--chunk-size", type=int, default=100000)
+    args = parser.parse_args()
+    os.makedirs(args.directory, exist_ok=True)
+
+    app = create_app()
+    with app.app_context():
+        snapshot_repository.begin_snapshot()
+        generation = anime_repository.get_import_generation()
+        for table in SNAPSHOT_TABLES:
+            start = time.perf_counter()
+            row_count = export_table(args.directory, table, args.chunk_size)
+            print(f"{table}: {row_count} rows in {time.perf_counter() - start:.1f} s")
+    with open(
+        os.path.join(args.directory, "generation"), "w", encoding="utf-8"
+    ) as file:
+        file.write(f"{generation}\n")
+    sys.exit(0)
+
+
+main()
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional, Union
+
+from flask import Flask
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+import response_cache
+from repositories import anime_repository
+
+# {% cache "name", key... %}...{% endcache %} stores the rendered block under
+# the given key. Keys include a version stamp from anime_version() or
+# catalog_version(), which change when an anime's score or the catalog changes.
+# Without RESPONSE_CACHE_DIR, anime versions are only bumped in the worker that
+# handled the write, so fragments also expire after FRAGMENT_CACHE_SECONDS.
+
+
+class FragmentCache:
+    def __init__(self, max_size: int, max_age: float):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.size = 0
+        self.fragments = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Markup]:
+        with self.lock:
+            entry = self.fragments.get(key)
+            if entry is None:
+                return None
+            fragment, created = entry
+            if time.monotonic() - created > self.max_age:
+                self._remove(key)
+                return None
+            self.fragments.move_to_end(key)
+            return fragment
+
+    def set(self, key: tuple, fragment: Markup) -> None:
+        with self.lock:
+            self._remove(key)
+            self.fragments[key] = (fragment, time.monotonic())
+            self.size += len(fragment)
+            while self.size > self.max_size:
+                _, (oldest, _) = self.fragments.popitem(last=False)
+                self.size -= len(oldest)
+
+    def _remove(self, key: tuple) -> None:
+        entry = self.fragments.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+
+fragment_cache = FragmentCache(
+    int(os.getenv("FRAGMENT_CACHE_SIZE", str(16 * 1024**2))),
+    float(os.getenv("FRAGMENT_CACHE_SECONDS", "60")),
+)
+
+
+class FragmentCacheExtension(Extension):
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("render_cached", [nodes.List(key)]), [], [], body
+        ).set_lineno(lineno)
+
+    def render_cached(self, key: list, caller: Callable) -> Markup:
+        # pylint: disable=no-self-use
+        key = tuple(key)
+        fragment = fragment_cache.get(key)
+        if fragment is None:
+            fragment = Markup(caller())
+            fragment_cache.set(key, fragment)
+        return fragment
+
+
+def catalog_version() -> str:
+    return str(anime_repository.get_import_generation())
+
+
+def anime_version(anime_ids: Union[int, Iterable[int]]) -> str:
+    anime_ids = [anime_ids] if isinstance(anime_ids, int) else anime_ids
+    versions = (str(response_cache.version(f"anime-{i}")) for i in anime_ids)
+    return f"{catalog_version()}:{','.join(versions)}"
+
+
+def init_app(app: Flask) -> None:
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.add_template_global(catalog_version)
+    app.add_template_global(anime_version)
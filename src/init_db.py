@@ -1,51 +1,86 @@
+import csv
+import io
 import json
+import os
 import sys
-from typing import Callable
+import time
+from multiprocessing import Pool
+from typing import Optional
 
 from tqdm import tqdm
 
-from repositories import anime_repository, initialization_repository
-
-
-def iterate_data(data: dict, add_data_to_db: Callable[[dict, str], None]) -> None:
-    for anime_data in tqdm(data["data"]):
-        # Get MyAnimeList link from anime sources
-        for source in anime_data["sources"]:
-            if "myanimelist.net" in source:
-                add_data_to_db(anime_data, source)
-                break
-
-
-def add_anime_data(anime_data: dict, myanimelist_link: str) -> None:
-    anime = {
-        "title": anime_data["title"],
-        "episodes": anime_data["episodes"],
-        "link": myanimelist_link,
-        "picture": anime_data["picture"],
-        "thumbnail": anime_data["thumbnail"],
-        "hidden": "hentai" in anime_data["tags"],
+from repositories import initialization_repository
+
+# The import is a pipeline: worker processes turn chunks of records into CSV
+# batches while this process streams the batches into PostgreSQL with COPY.
+# Anime ids are derived from the record's position so that chunks can be
+# transformed independently.
+ANIME_COLUMNS = ("id", "title", "episodes", "link", "picture", "thumbnail", "hidden")
+
+
+def get_myanimelist_link(anime_data: dict) -> Optional[str]:
+    for source in anime_data["sources"]:
+        if "myanimelist.net" in source:
+            return source
+    return None
+
+
+def to_csv(rows: list) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n").writerows(
+        rows
+    )
+    return buffer.getvalue()
+
+
+def transform_chunk(chunk: tuple) -> dict:
+    start_time = time.process_time()
+    start, records = chunk
+    anime_rows = []
+    synonym_rows = []
+    tag_rows = []
+    relations = []
+    for position, anime_data in enumerate(records, start + 1):
+        link = get_myanimelist_link(anime_data)
+        if not link:
+            continue
+        anime_rows.append(
+            (
+                position,
+                anime_data["title"],
+                anime_data["episodes"],
+                link,
+                anime_data["picture"],
+                anime_data["thumbnail"],
+                "hentai" in anime_data["tags"],
+            )
+        )
+        synonym_rows.extend((position, synonym) for synonym in anime_data["synonyms"])
+        tag_rows.extend((position, tag) for tag in anime_data["tags"])
+        relations.extend(
+            (position, relation)
+            for relation in anime_data["relations"]
+            if "myanimelist.net" in relation
+        )
+
+    return {
+        "records": len(records),
+        "links": [(row[3], row[0]) for row in anime_rows],
+        "anime": to_csv(anime_rows),
+        "synonyms": to_csv(synonym_rows),
+        "tags": to_csv(tag_rows),
+        "relations": relations,
+        "time": time.process_time() - start_time,
     }
-    anime_id = initialization_repository.add_anime(anime)
-
-    # Add synonyms
-    for synonym in anime_data["synonyms"]:
-        initialization_repository.add_synonym(anime_id, synonym)
 
-    # Add tags
-    for tag in anime_data["tags"]:
-        initialization_repository.add_tag(anime_id, tag)
 
+def print_throughput(stage: str, records: int, seconds: float) -> None:
+    # An empty or very fast stage can take no measurable time
+    rate = f" ({records / seconds:.0f}/s)" if seconds > 0 else ""
+    print(f"{stage}: {records} records in {seconds:.2f} s{rate}")
 
-def add_relations(anime_data: dict, myanimelist_link: str) -> None:
-    anime_id = anime_repository.get_anime_id(myanimelist_link)
-    for relation in anime_data["relations"]:
-        if "myanimelist.net" in relation:
-            related_id = anime_repository.get_anime_id(relation)
-            if related_id:
-                initialization_repository.add_relation(anime_id, related_id)
 
-
-def import_data() -> None:
+def import_data(workers: Optional[int] = None, chunk_size: int = 1000) -> None:
     print("Opening file 'anime-offline-database-minified.json'")
     try:
         with open(
@@ -63,17 +98,53 @@ def import_data() -> None:
     print("Initializing tables")
     initialization_repository.init_tables()
 
-    print("Adding anime, tags, and synonyms to the database")
-    iterate_data(data, add_anime_data)
+    workers = workers or os.cpu_count() or 1
+    records = data["data"]
+    chunks = [
+        (start, records[start : start + chunk_size])
+        for start in range(0, len(records), chunk_size)
+    ]
+    link_ids = {}
+    relations = []
+    transform_time = 0.0
+    write_time = 0.0
+
+    print(f"Adding anime, tags, and synonyms to the database using {workers} workers")
+    start_time = time.perf_counter()
+    with Pool(workers) as pool, tqdm(total=len(records)) as progress:
+        for batch in pool.imap(transform_chunk, chunks):
+            write_start = time.perf_counter()
+            initialization_repository.copy_rows("anime", ANIME_COLUMNS, batch["anime"])
+            initialization_repository.copy_rows(
+                "synonyms", ("anime_id", "synonym"), batch["synonyms"]
+            )
+            initialization_repository.copy_rows(
+                "tags", ("anime_id", "tag"), batch["tags"]
+            )
+            write_time += time.perf_counter() - write_start
+            transform_time += batch["time"]
+            link_ids.update(batch["links"])
+            relations.extend(batch["relations"])
+            progress.update(batch["records"])
+    total_time = time.perf_counter() - start_time
+    initialization_repository.reset_id_sequence("anime")
 
     print("Adding anime relations data to the database")
-    iterate_data(data, add_relations)
+    write_start = time.perf_counter()
+    relation_rows = [
+        (anime_id, link_ids[link]) for anime_id, link in relations if link in link_ids
+    ]
+    initialization_repository.copy_rows(
+        "relations", ("anime_id", "related_id"), to_csv(relation_rows)
+    )
+    write_time += time.perf_counter() - write_start
+
+    initialization_repository.set_import_generation()
 
     print("Committing changes")
     initialization_repository.commit()
 
+    print_throughput("Transform (per worker)", len(records), transform_time)
+    print_throughput("Write", len(records), write_time)
+    print_throughput("Total", len(records), total_time)
     print("Done!")
-    sys.exit(0)
-
-
-import_data()
@@ -0,0 +1,116 @@
+import cProfile
+import os
+import pstats
+import random
+import re
+import time
+from typing import Optional
+
+from flask import Flask, current_app, g, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+# Requests are profiled when PROFILE_DIR is set and either a random sample of
+# PROFILE_RATE (0 to 1) hits, or the request has an X-Profile header with a
+# token from "flask profile-token". Each profile is written as pstats and as
+# collapsed stacks that flamegraph tools can read.
+
+HEADER = "X-Profile"
+
+
+def get_serializer(app: Flask) -> URLSafeTimedSerializer:
+    return URLSafeTimedSerializer(app.secret_key, salt="profile")
+
+
+def create_token(app: Flask) -> str:
+    return get_serializer(app).dumps("profile")
+
+
+def has_valid_token() -> bool:
+    token = request.headers.get(HEADER)
+    if not token:
+        return False
+    try:
+        get_serializer(current_app).loads(token, max_age=24 * 60 * 60)
+    except BadSignature:
+        return False
+    return True
+
+
+def start_profile() -> None:
+    if not current_app.config.get("PROFILE_DIR"):
+        return
+    if random.random() < current_app.config["PROFILE_RATE"] or has_valid_token():
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def stop_profile(_: Optional[BaseException]) -> None:
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return
+    profiler.disable()
+
+    path = re.sub(r"[^A-Za-z0-9]+", "_", request.path).strip("_") or "index"
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{request.method}-{path}"
+    name = os.path.join(current_app.config["PROFILE_DIR"], name)
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(f"{name}.prof")
+    with open(f"{name}.collapsed", "w", encoding="utf-8") as file:
+        for stack, microseconds in collapse_stacks(stats).items():
+            file.write(f"{stack} {microseconds}\n")
+
+
+def function_name(function: tuple) -> str:
+    filename, line, name = function
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(";", ":")
+
+
+def collapse_stacks(stats: pstats.Stats, max_depth: int = 64) -> dict:
+    # cProfile only records caller and callee pairs, so time spent in a callee
+    # is split between its callers in proportion to the time of each call
+    callees = {}
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        for caller in callers:
+            callees.setdefault(caller, []).append(function)
+
+    stacks = {}
+
+    def visit(function: tuple, stack: str, fraction: float, path: set) -> None:
+        _, _, self_time, total_time, _ = stats.stats[function]
+        if total_time * fraction < 1e-6:
+            return
+        microseconds = round(self_time * fraction * 1e6)
+        if microseconds:
+            stacks[stack] = stacks.get(stack, 0) + microseconds
+        if len(path) >= max_depth or not total_time:
+            return
+        for callee in callees.get(function, ()):
+            if callee in path:
+                continue
+            callee_total = stats.stats[callee][3]
+            call_time = stats.stats[callee][4][function][3]
+            if callee_total and call_time:
+                visit(
+                    callee,
+                    f"{stack};{function_name(callee)}",
+                    fraction * call_time / callee_total,
+                    path | {callee},
+                )
+
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            visit(function, function_name(function), 1.0, {function})
+    return stacks
+
+
+def init_app(app: Flask) -> None:
+    app.config["PROFILE_DIR"] = os.getenv("PROFILE_DIR")
+    app.config["PROFILE_RATE"] = float(os.getenv("PROFILE_RATE", "0"))
+    if app.config["PROFILE_DIR"]:
+        os.makedirs(app.config["PROFILE_DIR"], exist_ok=True)
+    app.before_request(start_profile)
+    app.teardown_request(stop_profile)
+
+    @app.cli.command("profile-token")
+    def profile_token_command() -> None:
+        print(f"{HEADER}: {create_token(app)}")
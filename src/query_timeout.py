@@ -0,0 +1,49 @@
+from functools import wraps
+from typing import Callable
+
+from flask import Flask, Response, make_response, render_template
+from psycopg2.errors import QueryCanceled
+from sqlalchemy.exc import OperationalError
+
+from database import database
+
+# Views decorated with statement_timeout() cancel queries that take longer than
+# their budget. The cancelled view raises QueryTimeout, which is answered with a
+# stale cached page when there is one, and with a "try again" page otherwise.
+
+RETRY_AFTER_SECONDS = 5
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+def statement_timeout(milliseconds: int) -> Callable:
+    def decorator(view: Callable) -> Callable:
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # SET LOCAL lasts until the end of the current transaction
+            database.session.execute(
+                f"SET LOCAL statement_timeout = {int(milliseconds)}"
+            )
+            try:
+                return view(*args, **kwargs)
+            except OperationalError as error:
+                if not isinstance(error.orig, QueryCanceled):
+                    raise
+                database.session.rollback()
+                raise QueryTimeout() from error
+
+        return wrapper
+
+    return decorator
+
+
+def handle_timeout(_: QueryTimeout) -> Response:
+    response = make_response(render_template("busy.html"), 503)
+    response.headers["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return response
+
+
+def init_app(app: Flask) -> None:
+    app.register_error_handler(QueryTimeout, handle_timeout)
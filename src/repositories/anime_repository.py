@@ -1,11 +1,78 @@
+from functools import lru_cache
 from typing import Optional
 
-from flask import session
+from flask import g, session
 
+import request_memo
+import response_cache
 from database import database
 
+# The SQL of the catalog reads is shared with the async JSON API in api.py
+ANIME_METADATA_SQL = (
+    "SELECT id, title, link, episodes, picture FROM anime WHERE id = :id"
+)
+
+SCORE_SQL = """
+    SELECT ROUND(score_sum::NUMERIC / NULLIF(score_count, 0), 2)
+    FROM anime_stats
+    WHERE anime_id = :id
+"""
+
+TOP_ANIME_SQL = """
+    SELECT a.id, a.thumbnail, a.title, a.episodes,
+        ROUND(st.score_sum::NUMERIC / NULLIF(st.score_count, 0), 2)
+    FROM anime a
+        LEFT JOIN anime_stats st ON st.anime_id = a.id
+        LEFT JOIN synonyms s ON s.anime_id = a.id
+    WHERE (NOT a.hidden OR :show_hidden) AND (
+        :query = '%%' OR a.title ILIKE :query
+        OR (s.synonym IS NOT NULL AND s.synonym ILIKE :query)
+    )
+    GROUP BY a.id, st.anime_id
+    ORDER BY COALESCE(st.score_sum::NUMERIC / NULLIF(st.score_count, 0), 0) DESC,
+        COALESCE(st.list_count, 0) DESC, a.title
+    LIMIT 50
+    OFFSET :offset
+"""
+
+TOP_ANIME_TAG_SQL = """
+    SELECT a.id, a.thumbnail, a.title, a.episodes,
+        ROUND(st.score_sum::NUMERIC / NULLIF(st.score_count, 0), 2)
+    FROM tags t, anime a
+        LEFT JOIN anime_stats st ON st.anime_id = a.id
+        LEFT JOIN synonyms s ON s.anime_id = a.id
+    WHERE (NOT a.hidden OR :show_hidden) AND a.id = t.anime_id AND t.tag = :tag AND (
+        :query = '%%' OR a.title ILIKE :query
+        OR (s.synonym IS NOT NULL AND s.synonym ILIKE :query)
+    )
+    GROUP BY a.id, st.anime_id
+    ORDER BY COALESCE(st.score_sum::NUMERIC / NULLIF(st.score_count, 0), 0) DESC,
+        COALESCE(st.list_count, 0) DESC, a.title
+    LIMIT 50
+    OFFSET :offset
+"""
+
+TOP_ANIME_BY_IDS_SQL = """
+    SELECT a.id, a.thumbnail, a.title, a.episodes,
+        ROUND(st.score_sum::NUMERIC / NULLIF(st.score_count, 0), 2)
+    FROM anime a
+        LEFT JOIN anime_stats st ON st.anime_id = a.id
+    WHERE a.id = ANY(:anime_ids)
+    ORDER BY COALESCE(st.score_sum::NUMERIC / NULLIF(st.score_count, 0), 0) DESC,
+        COALESCE(st.list_count, 0) DESC, a.title
+    LIMIT 50
+    OFFSET :offset
+"""
+
 
 def anime_count(query: str, tag: str) -> int:
+    return _anime_count(
+        query, tag, session["show_hidden"] if "show_hidden" in session else False
+    )
+
+
+@response_cache.shared_read()
+def _anime_count(query: str, tag: str, show_hidden: bool) -> int:
     if not tag:
         sql = """
             SELECT COUNT(DISTINCT a.id)
@@ -29,95 +96,110 @@ def anime_count(query: str, tag: str) -> int:
 
     row = database.session.execute(
         sql,
-        {
-            "query": f"%{query}%",
-            "tag": tag,
-            "show_hidden": session["show_hidden"]
-            if "show_hidden" in session
-            else False,
-        },
+        {"query": f"%{query}%", "tag": tag, "show_hidden": show_hidden},
     ).fetchone()
     return row[0] if row else 0
 
 
-def get_anime_id(mal_link: str) -> Optional[int]:
-    sql = "SELECT id FROM anime WHERE link = :link"
-    row = database.session.execute(sql, {"link": mal_link}).fetchone()
-    return None if not row else row[0]
+# Anime metadata only changes when the database is initialized, so it is cached
+# per process. The import generation is part of the cache key.
+def get_import_generation() -> Optional[str]:
+    if "import_generation" not in g:
+        sql = "SELECT generation FROM catalog"
+        row = database.session.execute(sql).fetchone()
+        g.import_generation = row[0] if row else None
+    return g.import_generation
 
 
-def get_anime_id_and_episodes(mal_link: str) -> Optional[tuple]:
+@lru_cache(maxsize=8192)
+def _get_anime_metadata(generation: Optional[str], anime_id: int) -> Optional[tuple]:
+    # pylint: disable=unused-argument
+    row = database.session.execute(ANIME_METADATA_SQL, {"id": anime_id}).fetchone()
+    return None if not row else tuple(row)
+
+
+@lru_cache(maxsize=8192)
+def _get_anime_id_and_episodes(
+    generation: Optional[str], mal_link: str
+) -> Optional[tuple]:
+    # pylint: disable=unused-argument
     sql = "SELECT id, episodes FROM anime WHERE link = :link"
     row = database.session.execute(sql, {"link": mal_link}).fetchone()
     return None if not row else (row[0], row[1])
 
 
+def get_anime_id_and_episodes(mal_link: str) -> Optional[tuple]:
+    return _get_anime_id_and_episodes(get_import_generation(), mal_link)
+
+
+def get_episodes(anime_id: int) -> Optional[int]:
+    metadata = _get_anime_metadata(get_import_generation(), anime_id)
+    return None if not metadata else metadata[3]
+
+
+def get_score(anime_id: int) -> Optional[float]:
+    row = database.session.execute(SCORE_SQL, {"id": anime_id}).fetchone()
+    return row[0] if row else None
+
+
+@request_memo.reads("list")
 def get_anime(anime_id: int) -> Optional[dict]:
-    sql = """
-        SELECT a.id, a.title, a.link, a.episodes, ROUND(AVG(l.score), 2), a.picture
-        FROM anime a
-            LEFT JOIN list l ON l.anime_id = a.id
-        WHERE a.id = :id
-        GROUP BY a.id
-    """
-    row = database.session.execute(sql, {"id": anime_id}).fetchone()
-    return (
-        None
-        if not row
-        else {
-            "id": row[0],
-            "title": row[1],
-            "link": row[2],
-            "episodes": row[3],
-            "score": row[4],
-            "picture": row[5],
-        }
-    )
+    metadata = _get_anime_metadata(get_import_generation(), anime_id)
+    if not metadata:
+        return None
+    return {
+        "id": metadata[0],
+        "title": metadata[1],
+        "link": metadata[2],
+        "episodes": metadata[3],
+        "score": get_score(anime_id),
+        "picture": metadata[4],
+    }
 
 
 def get_top_anime(page: int, query: str, tag: str) -> list:
-    if not tag:
-        sql = """
-            SELECT a.id, a.thumbnail, a.title, a.episodes, ROUND(AVG(l.score), 2)
-            FROM anime a
-                LEFT JOIN list l ON l.anime_id = a.id
-                LEFT JOIN synonyms s ON s.anime_id = a.id
-            WHERE (NOT a.hidden OR :show_hidden) AND (
-                :query = '%%' OR a.title ILIKE :query
-                OR (s.synonym IS NOT NULL AND s.synonym ILIKE :query)
-            )
-            GROUP BY a.id
-            ORDER BY COALESCE(AVG(l.score), 0) DESC, COUNT(l.id) DESC, a.title
-            LIMIT 50
-            OFFSET :offset
-        """
-    else:
-        sql = """
-            SELECT a.id, a.thumbnail, a.title, a.episodes, ROUND(AVG(l.score), 2)
-            FROM tags t, anime a
-                LEFT JOIN list l ON l.anime_id = a.id
-                LEFT JOIN synonyms s ON s.anime_id = a.id
-            WHERE (NOT a.hidden OR :show_hidden) AND a.id = t.anime_id AND t.tag = :tag AND (
-                :query = '%%' OR a.title ILIKE :query
-                OR (s.synonym IS NOT NULL AND s.synonym ILIKE :query)
-            )
-            GROUP BY a.id
-            ORDER BY COALESCE(AVG(l.score), 0) DESC, COUNT(l.id) DESC, a.title
-            LIMIT 50
-            OFFSET :offset
-            """
+    return with_in_list(
+        _get_top_anime(
+            page,
+            query,
+            tag,
+            session["show_hidden"] if "show_hidden" in session else False,
+        )
+    )
+
+
+@response_cache.shared_read("scores")
+def _get_top_anime(page: int, query: str, tag: str, show_hidden: bool) -> list:
     result = database.session.execute(
-        sql,
+        TOP_ANIME_SQL if not tag else TOP_ANIME_TAG_SQL,
         {
             "offset": page,
             "query": f"%{query}%",
             "tag": tag,
-            "show_hidden": session["show_hidden"]
-            if "show_hidden" in session
-            else False,
+            "show_hidden": show_hidden,
         },
     )
+    return [
+        {
+            "id": row[0],
+            "thumbnail": row[1],
+            "title": row[2],
+            "episodes": row[3],
+            "score": row[4],
+        }
+        for row in result.fetchall()
+    ]
+
 
+def get_top_anime_by_ids(page: int, anime_ids: list) -> list:
+    return with_in_list(_get_top_anime_by_ids(page, anime_ids))
+
+
+@response_cache.shared_read("scores")
+def _get_top_anime_by_ids(page: int, anime_ids: list) -> list:
+    result = database.session.execute(
+        TOP_ANIME_BY_IDS_SQL, {"offset": page, "anime_ids": anime_ids}
+    )
     return [
         {
             "id": row[0],
@@ -128,3 +210,50 @@ def get_top_anime(page: int, query: str, tag: str) -> list:
         }
         for row in result.fetchall()
     ]
+
+
+# The pages above are shared by all users, whether an anime is in the user's list
+# is looked up separately
+def with_in_list(top_anime: list) -> list:
+    in_list = set()
+    if "user_id" in session and top_anime:
+        sql = """
+            SELECT anime_id FROM list
+            WHERE user_id = :user_id AND anime_id = ANY(:anime_ids)
+        """
+        result = database.session.execute(
+            sql,
+            {
+                "user_id": session["user_id"],
+                "anime_ids": [anime["id"] for anime in top_anime],
+            },
+        )
+        in_list = {row[0] for row in result.fetchall()}
+    return [{**anime, "in_list": anime["id"] in in_list} for anime in top_anime]
+
+
+def autocomplete(query: str) -> list:
+    sql = """
+        SELECT a.id, a.title
+        FROM anime a
+            LEFT JOIN synonyms s ON s.anime_id = a.id
+        WHERE (NOT a.hidden OR :show_hidden) AND (
+            a.title ILIKE :query OR (s.synonym IS NOT NULL AND s.synonym ILIKE :query)
+        )
+        GROUP BY a.id
+        ORDER BY NOT BOOL_OR(
+            a.title ILIKE :prefix OR COALESCE(s.synonym ILIKE :prefix, FALSE)
+        ), a.title
+        LIMIT 10
+    """
+    result = database.session.execute(
+        sql,
+        {
+            "query": f"%{query}%",
+            "prefix": f"{query}%",
+            "show_hidden": session["show_hidden"]
+            if "show_hidden" in session
+            else False,
+        },
+    )
+    return [{"id": row[0], "title": row[1]} for row in result.fetchall()]
@@ -1,37 +1,107 @@
+import io
+from secrets import token_hex
+
 from database import database
 
 
 def init_tables() -> None:
-    sql = "DROP TABLE IF EXISTS users, anime, relations, synonyms, list, tags"
+    sql = """
+        DROP TABLE IF EXISTS
+            users, anime, relations, synonyms, list, tags, user_stats, user_tag_stats,
+            anime_stats, catalog
+    """
     database.session.execute(sql)
     with open("../schema.sql", "r", encoding="utf-8") as file:
         sql = "".join(file.readlines())
     database.session.execute(sql)
 
 
-def add_anime(anime: dict) -> int:
-    sql = """
-        INSERT INTO anime (title, episodes, link, picture, thumbnail, hidden)
-        VALUES (:title, :episodes, :link, :picture, :thumbnail, :hidden)
-        Returning id
-    """
-    return database.session.execute(sql, anime).fetchone()[0]
+def copy_rows(table: str, columns: tuple, csv_data: str) -> None:
+    if not csv_data:
+        return
+    cursor = database.session.connection().connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        io.StringIO(csv_data),
+    )
+
+
+def reset_id_sequence(table: str) -> None:
+    sql = (
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), MAX(id)) FROM {table}"
+    )
+    database.session.execute(sql)
 
 
-def add_synonym(anime_id: int, synonym: str) -> None:
-    sql = "INSERT INTO synonyms (anime_id, synonym) VALUES (:anime_id, :synonym)"
-    database.session.execute(sql, {"anime_id": anime_id, "synonym": synonym})
+def set_import_generation() -> None:
+    sql = "DELETE FROM catalog"
+    database.session.execute(sql)
+    sql = "INSERT INTO catalog (generation) VALUES (:generation)"
+    database.session.execute(sql, {"generation": token_hex(16)})
 
 
-def add_tag(anime_id: int, tag: str) -> None:
-    sql = "INSERT INTO tags (anime_id, tag) VALUES (:anime_id, :tag)"
-    database.session.execute(sql, {"anime_id": anime_id, "tag": tag})
+def commit() -> None:
+    database.session.commit()
 
 
-def add_relation(anime_id: int, related_id: int) -> None:
-    sql = "INSERT INTO relations (anime_id, related_id) VALUES (:anime_id, :related_id)"
-    database.session.execute(sql, {"anime_id": anime_id, "related_id": related_id})
+def is_list_partitioned() -> bool:
+    sql = "SELECT relkind = 'p' FROM pg_class WHERE oid = 'list'::regclass"
+    return database.session.execute(sql).fetchone()[0]
 
 
-def commit() -> None:
+def partition_list(partitions: int) -> None:
+    # The rows are copied to a new table partitioned by user_id in a single
+    # transaction that locks the list table, so both list reads and writes wait
+    # until the copy is done. A weaker lock during the copy would have to be
+    # upgraded for the rename, which deadlocks with edits that already read the
+    # list. The old table's index names are freed first so the new table can
+    # use them.
+    statements = [
+        "LOCK TABLE list IN ACCESS EXCLUSIVE MODE",
+        "ALTER TABLE list RENAME TO list_unpartitioned",
+        "ALTER INDEX list_pkey RENAME TO list_unpartitioned_pkey",
+        """
+        ALTER INDEX list_user_id_anime_id_key
+        RENAME TO list_unpartitioned_user_id_anime_id_key
+        """,
+        "ALTER INDEX list_anime_id_idx RENAME TO list_unpartitioned_anime_id_idx",
+        "ALTER SEQUENCE list_id_seq OWNED BY NONE",
+        """
+        CREATE TABLE list (
+            id INT NOT NULL DEFAULT nextval('list_id_seq'),
+            user_id INT REFERENCES users NOT NULL,
+            anime_id INT REFERENCES anime NOT NULL,
+            episodes INT NOT NULL DEFAULT 0,
+            score INT DEFAULT NULL,
+            status TEXT NOT NULL DEFAULT 'Watching',
+            times_watched INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, id),
+            UNIQUE (user_id, anime_id)
+        ) PARTITION BY HASH (user_id)
+        """,
+        # Score and episode edits are the most common writes. They stay HOT
+        # updates, which skip index maintenance, as long as no index contains
+        # those columns and the page has room for the new row version.
+        *(
+            f"""
+            CREATE TABLE list_{i} PARTITION OF list
+            FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})
+            WITH (fillfactor = 90)
+            """
+            for i in range(partitions)
+        ),
+        # For the list page filtered by status
+        "CREATE INDEX list_user_id_status_idx ON list (user_id, status)",
+        "CREATE INDEX list_anime_id_idx ON list (anime_id)",
+        """
+        INSERT INTO list (id, user_id, anime_id, episodes, score, status, times_watched)
+        SELECT id, user_id, anime_id, episodes, score, status, times_watched
+        FROM list_unpartitioned
+        """,
+        "ALTER SEQUENCE list_id_seq OWNED BY list.id",
+        "DROP TABLE list_unpartitioned",
+        "ANALYZE list",
+    ]
+    for sql in statements:
+        database.session.execute(sql)
     database.session.commit()
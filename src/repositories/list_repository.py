@@ -1,23 +1,42 @@
-from typing import Optional
+from typing import Iterator, Optional
 
 from psycopg2.errors import UniqueViolation
+from sqlalchemy import text
 from sqlalchemy.exc import IntegrityError
 
+import request_memo
+import response_cache
 from database import database
+from repositories import stats_repository
+
+LIST_PAGE_SIZE = 100
+# Sort keys are ascending, ties are broken by title and id
+LIST_SORTS = {
+    "title": "a.title",
+    "score": "-COALESCE(l.score, 0)",
+    "progress": "-l.episodes",
+}
+LIST_TAG_FILTER = """
+    AND EXISTS (SELECT 1 FROM tags t WHERE t.anime_id = l.anime_id AND t.tag = :tag)
+"""
 
 
 # Database functions
+@request_memo.writes("list")
 def add_to_list(user_id: int, anime_id: int) -> None:
     try:
         sql = "INSERT INTO list (user_id, anime_id) VALUES (:user_id, :anime_id)"
         database.session.execute(sql, {"user_id": user_id, "anime_id": anime_id})
+        stats_repository.update_stats(user_id, anime_id, "Watching", None, 1)
         database.session.commit()
+        response_cache.invalidate_score_write(user_id, anime_id)
     except IntegrityError as error:
         # UNIQUE constraint fail
         assert isinstance(error.orig, UniqueViolation)
         database.session.rollback()
 
 
+@request_memo.writes("list")
 def import_to_list(user_id: int, anime_data: dict) -> bool:
     try:
         sql = """
@@ -25,7 +44,15 @@ def import_to_list(user_id: int, anime_data: dict) -> bool:
             VALUES (:user_id, :anime_id, :episodes, :score, :status, :times_watched)
         """
         database.session.execute(sql, {**anime_data, "user_id": user_id})
+        stats_repository.update_stats(
+            user_id,
+            anime_data["anime_id"],
+            anime_data["status"],
+            anime_data["score"],
+            1,
+        )
         database.session.commit()
+        response_cache.invalidate_score_write(user_id, anime_data["anime_id"])
     except IntegrityError as error:
         # UNIQUE constraint fail
         assert isinstance(error.orig, UniqueViolation)
@@ -33,20 +60,42 @@ def import_to_list(user_id: int, anime_data: dict) -> bool:
     return True
 
 
+@request_memo.writes("list")
 def remove_from_list(user_id: int, anime_id: int) -> None:
-    sql = "DELETE FROM list WHERE user_id = :user_id AND anime_id = :anime_id"
-    database.session.execute(sql, {"user_id": user_id, "anime_id": anime_id})
+    sql = """
+        DELETE FROM list WHERE user_id = :user_id AND anime_id = :anime_id
+        RETURNING status, score
+    """
+    row = database.session.execute(
+        sql, {"user_id": user_id, "anime_id": anime_id}
+    ).fetchone()
+    if row:
+        stats_repository.update_stats(user_id, anime_id, row[0], row[1], -1)
     database.session.commit()
+    response_cache.invalidate_score_write(user_id, anime_id)
 
 
+@request_memo.writes("list")
 def set_score(user_id: int, anime_id: int, score: Optional[int]) -> None:
-    sql = "UPDATE list SET score = :score WHERE user_id = :user_id AND anime_id = :anime_id"
-    database.session.execute(
+    # Joining the old row returns the values from before the update
+    sql = """
+        UPDATE list l SET score = :score
+        FROM list o
+        WHERE o.user_id = l.user_id AND o.anime_id = l.anime_id
+            AND l.user_id = :user_id AND l.anime_id = :anime_id
+        RETURNING o.status, o.score
+    """
+    row = database.session.execute(
         sql, {"user_id": user_id, "anime_id": anime_id, "score": score}
-    )
+    ).fetchone()
+    if row:
+        stats_repository.update_stats(user_id, anime_id, row[0], row[1], -1)
+        stats_repository.update_stats(user_id, anime_id, row[0], score, 1)
     database.session.commit()
+    response_cache.invalidate_score_write(user_id, anime_id)
 
 
+@request_memo.writes("list")
 def set_times_watched(user_id: int, anime_id: int, times_watched: int) -> None:
     sql = """
         UPDATE list SET times_watched = :times_watched
@@ -56,8 +105,10 @@ def set_times_watched(user_id: int, anime_id: int, times_watched: int) -> None:
         sql, {"user_id": user_id, "anime_id": anime_id, "times_watched": times_watched}
     )
     database.session.commit()
+    response_cache.invalidate_list_write(user_id)
 
 
+@request_memo.writes("list")
 def add_times_watched(user_id: int, anime_id: int, add: int) -> None:
     sql = """
         UPDATE list SET times_watched = times_watched + :add
@@ -67,16 +118,29 @@ def add_times_watched(user_id: int, anime_id: int, add: int) -> None:
         sql, {"user_id": user_id, "anime_id": anime_id, "add": add}
     )
     database.session.commit()
+    response_cache.invalidate_list_write(user_id)
 
 
+@request_memo.writes("list")
 def set_status(user_id: int, anime_id: int, status: str) -> None:
-    sql = "UPDATE list SET status = :status WHERE user_id = :user_id AND anime_id = :anime_id"
-    database.session.execute(
+    # Joining the old row returns the values from before the update
+    sql = """
+        UPDATE list l SET status = :status
+        FROM list o
+        WHERE o.user_id = l.user_id AND o.anime_id = l.anime_id
+            AND l.user_id = :user_id AND l.anime_id = :anime_id
+        RETURNING o.status, o.score
+    """
+    row = database.session.execute(
         sql, {"user_id": user_id, "anime_id": anime_id, "status": status}
-    )
+    ).fetchone()
+    if row:
+        stats_repository.update_status_stats(user_id, row[0], status)
     database.session.commit()
+    response_cache.invalidate_list_write(user_id)
 
 
+@request_memo.writes("list")
 def set_episodes_watched(user_id: int, anime_id: int, episodes_watched: int) -> None:
     sql = """
         UPDATE list SET episodes = :episodes_watched
@@ -92,8 +156,10 @@ def set_episodes_watched(user_id: int, anime_id: int, episodes_watched: int) ->
         },
     )
     database.session.commit()
+    response_cache.invalidate_list_write(user_id)
 
 
+@request_memo.reads("list")
 def get_user_anime_data(user_id: int, anime_id: int) -> Optional[dict]:
     sql = """
         SELECT score, episodes, status, times_watched
@@ -117,70 +183,55 @@ def get_user_anime_data(user_id: int, anime_id: int) -> Optional[dict]:
     )
 
 
-def get_counts(user_id: int) -> dict:
-    sql = """
-        SELECT 
-            COUNT(*),
-            COUNT(CASE WHEN status LIKE 'Completed' THEN 1 END),
-            COUNT(CASE WHEN status LIKE 'Watching' THEN 1 END),
-            COUNT(CASE WHEN status LIKE 'On-Hold' THEN 1 END),
-            COUNT(CASE WHEN status LIKE 'Dropped' THEN 1 END),
-            COUNT(CASE WHEN status LIKE 'Plan to Watch' THEN 1 END)
-        FROM list
-        WHERE user_id = :user_id
-    """
-    row = database.session.execute(sql, {"user_id": user_id}).fetchone()
-    return {
-        "total": row[0],
-        "completed": row[1],
-        "watching": row[2],
-        "on_hold": row[3],
-        "dropped": row[4],
-        "plan_to_watch": row[5],
-    }
-
-
-def get_watched_tags(user_id: int) -> list:
-    sql = """
-        SELECT t.tag, COUNT(l.id)
-        FROM list l, tags t
-        WHERE user_id = :user_id AND t.anime_id = l.anime_id
-        GROUP BY t.tag
-        ORDER BY COUNT(l.id) DESC, t.tag
+@request_memo.reads("list")
+def get_list_count(user_id: int, status: str, tag: str) -> int:
+    tag_filter = "" if not tag else LIST_TAG_FILTER
+    sql = f"""
+        SELECT COUNT(*)
+        FROM list l
+        WHERE l.user_id = :user_id AND (l.status = :status OR :status = 'All')
+            {tag_filter}
     """
-    result = database.session.execute(sql, {"user_id": user_id}).fetchall()
-    return result
-
-
-def get_popular_tags(user_id: int) -> list:
-    sql = """
-        SELECT t.tag, ROUND(AVG(l.score), 2)
-        FROM list l, tags t
-        WHERE user_id = :user_id AND t.anime_id = l.anime_id
-        GROUP BY t.tag
-        ORDER BY COALESCE(AVG(l.score), 0) DESC, t.tag
-    """
-    result = database.session.execute(sql, {"user_id": user_id}).fetchall()
-    return result
-
-
-def get_list_ids(user_id: int) -> list:
-    sql = "SELECT anime_id FROM list WHERE user_id = :user_id"
-    result = database.session.execute(sql, {"user_id": user_id})
-    return [row[0] for row in result.fetchall()]
+    row = database.session.execute(
+        sql, {"user_id": user_id, "status": status, "tag": tag}
+    ).fetchone()
+    return row[0]
 
 
-def get_list_data(user_id: int, status: str, tag: str) -> list:
-    sql = """
+def list_data_sql(sort: str, tag: str) -> str:
+    # Keyset pagination: rows come after the row of anime 'after' in the sort order.
+    # Shared with the async JSON API in api.py.
+    key = LIST_SORTS[sort]
+    tag_filter = "" if not tag else LIST_TAG_FILTER
+    return f"""
         SELECT a.id, a.thumbnail, a.title, l.episodes, a.episodes, l.status, l.score
-        FROM list l, anime a, tags t
-        WHERE l.anime_id = a.id AND t.anime_id = a.id AND l.user_id = :user_id
-            AND (:tag = '' OR t.tag = :tag) AND (l.status = :status OR :status = 'All')
-        GROUP BY a.id, l.id ORDER BY a.title
+        FROM list l, anime a
+        WHERE l.anime_id = a.id AND l.user_id = :user_id
+            AND (l.status = :status OR :status = 'All')
+            {tag_filter}
+            AND (CAST(:after AS INTEGER) IS NULL OR ({key}, a.title, a.id) > (
+                SELECT {key}, a.title, a.id
+                FROM list l, anime a
+                WHERE l.anime_id = a.id AND l.user_id = :user_id AND a.id = :after
+            ))
+        ORDER BY {key}, a.title, a.id
+        LIMIT :limit
     """
 
+
+@request_memo.reads("list")
+def get_list_data(
+    user_id: int, status: str, tag: str, sort: str, after: Optional[int], limit: int
+) -> list:
     result = database.session.execute(
-        sql, {"user_id": user_id, "status": status, "tag": tag}
+        list_data_sql(sort, tag),
+        {
+            "user_id": user_id,
+            "status": status,
+            "tag": tag,
+            "after": after,
+            "limit": limit,
+        },
     )
 
     return [
@@ -195,3 +246,27 @@ def get_list_data(user_id: int, status: str, tag: str) -> list:
         }
         for row in result.fetchall()
     ]
+
+
+def iterate_export_data(user_id: int) -> Iterator[dict]:
+    # stream_results uses a server-side cursor, so rows are fetched in batches
+    sql = """
+        SELECT a.link, a.title, a.episodes, l.episodes, l.score, l.status, l.times_watched
+        FROM list l, anime a
+        WHERE l.anime_id = a.id AND l.user_id = :user_id
+    """
+    result = database.session.execute(
+        text(sql).execution_options(stream_results=True), {"user_id": user_id}
+    )
+    while rows := result.fetchmany(1000):
+        for row in rows:
+            yield {
+                "link": row[0],
+                "title": row[1],
+                "episodes": row[2],
+                "episodes_watched": row[3],
+                "score": row[4],
+                "status": row[5],
+                "times_watched": row[6],
+            }
+    result.close()
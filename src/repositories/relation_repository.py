@@ -1,5 +1,14 @@
 from database import database
 
+# Shared with the async JSON API in api.py
+ANIME_RELATED_SQL = """
+    SELECT DISTINCT a.id, a.title, a.episodes, a.thumbnail,
+        ROUND(st.score_sum::NUMERIC / NULLIF(st.score_count, 0), 2)
+    FROM relations r, anime a
+        LEFT JOIN anime_stats st ON st.anime_id = a.id
+    WHERE a.id = r.related_id AND r.anime_id = :anime_id
+"""
+
 
 def related_anime_count(user_id: int) -> int:
     sql = """
@@ -15,13 +24,14 @@ def related_anime_count(user_id: int) -> int:
 
 def get_related_anime(page: int, user_id: int) -> list:
     sql = """
-        SELECT a.id, a.title, a.episodes, a.thumbnail, ROUND(AVG(l2.score), 2)
+        SELECT a.id, a.title, a.episodes, a.thumbnail,
+            ROUND(st.score_sum::NUMERIC / NULLIF(st.score_count, 0), 2)
         FROM relations r, list l1, anime a
-            LEFT JOIN list l2 ON a.id = l2.anime_id
+            LEFT JOIN anime_stats st ON st.anime_id = a.id
             LEFT JOIN list l3 ON a.id = l3.anime_id AND l3.user_id = :user_id
         WHERE l3.id IS NULL AND a.id = r.related_id
             AND l1.user_id = :user_id AND l1.anime_id = r.anime_id
-        GROUP BY a.id
+        GROUP BY a.id, st.anime_id
         LIMIT 50 OFFSET :page
     """
 
@@ -33,21 +43,16 @@ def get_related_anime(page: int, user_id: int) -> list:
             "episodes": row[2],
             "thumbnail": row[3],
             "score": row[4],
+            "in_list": False,
         }
         for row in data
     ]
 
 
 def get_anime_related_anime(anime_id: int) -> list:
-    sql = """
-        SELECT a.id, a.title, a.episodes, a.thumbnail, ROUND(AVG(l.score), 2)
-        FROM relations r, anime a
-            LEFT JOIN list l ON l.anime_id = a.id
-        WHERE a.id = r.related_id AND r.anime_id = :anime_id
-        GROUP BY a.id
-    """
-
-    data = database.session.execute(sql, {"anime_id": anime_id}).fetchall()
+    data = database.session.execute(
+        ANIME_RELATED_SQL, {"anime_id": anime_id}
+    ).fetchall()
     return [
         {
             "id": row[0],
@@ -0,0 +1,21 @@
+from typing import Iterator
+
+from sqlalchemy import text
+
+from database import database
+
+
+def begin_snapshot() -> None:
+    # Every table is read from the same snapshot of the database
+    database.session.connection(
+        execution_options={"isolation_level": "REPEATABLE READ"}
+    )
+
+
+def iterate_table(table: str, columns: tuple, chunk_size: int) -> Iterator[list]:
+    # stream_results uses a server-side cursor, so the table is read in chunks
+    sql = f"SELECT {', '.join(columns)} FROM {table}"
+    result = database.session.execute(text(sql).execution_options(stream_results=True))
+    while rows := result.fetchmany(chunk_size):
+        yield rows
+    result.close()
@@ -0,0 +1,168 @@
+from typing import Optional
+
+from database import database
+
+
+# Stats are updated with deltas inside the list mutation's transaction. Anime
+# scores are read from anime_stats, so pages of anime don't aggregate the list.
+# sign is 1 when an entry is added and -1 when an entry is removed.
+def update_stats(
+    user_id: int, anime_id: int, status: str, score: Optional[int], sign: int
+) -> None:
+    sql = """
+        INSERT INTO user_stats (user_id) VALUES (:user_id)
+        ON CONFLICT (user_id) DO NOTHING
+    """
+    database.session.execute(sql, {"user_id": user_id})
+
+    sql = """
+        UPDATE user_stats SET
+            total = total + :sign,
+            completed = completed + CASE WHEN :status = 'Completed' THEN :sign ELSE 0 END,
+            watching = watching + CASE WHEN :status = 'Watching' THEN :sign ELSE 0 END,
+            on_hold = on_hold + CASE WHEN :status = 'On-Hold' THEN :sign ELSE 0 END,
+            dropped = dropped + CASE WHEN :status = 'Dropped' THEN :sign ELSE 0 END,
+            plan_to_watch = plan_to_watch
+                + CASE WHEN :status = 'Plan to Watch' THEN :sign ELSE 0 END
+        WHERE user_id = :user_id
+    """
+    database.session.execute(sql, {"user_id": user_id, "status": status, "sign": sign})
+
+    sql = """
+        INSERT INTO user_tag_stats (user_id, tag, count, score_sum, score_count)
+        SELECT :user_id, t.tag, :sign * COUNT(*),
+            :sign * COUNT(*) * COALESCE(:score, 0),
+            CASE WHEN :score IS NULL THEN 0 ELSE :sign * COUNT(*) END
+        FROM tags t
+        WHERE t.anime_id = :anime_id
+        GROUP BY t.tag
+        ON CONFLICT (user_id, tag) DO UPDATE SET
+            count = user_tag_stats.count + EXCLUDED.count,
+            score_sum = user_tag_stats.score_sum + EXCLUDED.score_sum,
+            score_count = user_tag_stats.score_count + EXCLUDED.score_count
+    """
+    database.session.execute(
+        sql, {"user_id": user_id, "anime_id": anime_id, "score": score, "sign": sign}
+    )
+
+    if sign < 0:
+        sql = "DELETE FROM user_tag_stats WHERE user_id = :user_id AND count <= 0"
+        database.session.execute(sql, {"user_id": user_id})
+
+    sql = """
+        INSERT INTO anime_stats (anime_id, list_count, score_sum, score_count)
+        VALUES (
+            :anime_id, :sign, :sign * COALESCE(:score, 0),
+            CASE WHEN :score IS NULL THEN 0 ELSE :sign END
+        )
+        ON CONFLICT (anime_id) DO UPDATE SET
+            list_count = anime_stats.list_count + EXCLUDED.list_count,
+            score_sum = anime_stats.score_sum + EXCLUDED.score_sum,
+            score_count = anime_stats.score_count + EXCLUDED.score_count
+    """
+    database.session.execute(sql, {"anime_id": anime_id, "score": score, "sign": sign})
+
+
+def update_status_stats(user_id: int, old_status: str, new_status: str) -> None:
+    # Moving an entry between statuses leaves the totals, tag and anime stats as
+    # they are
+    sql = """
+        UPDATE user_stats SET
+            completed = completed
+                + CASE WHEN :new_status = 'Completed' THEN 1 ELSE 0 END
+                - CASE WHEN :old_status = 'Completed' THEN 1 ELSE 0 END,
+            watching = watching
+                + CASE WHEN :new_status = 'Watching' THEN 1 ELSE 0 END
+                - CASE WHEN :old_status = 'Watching' THEN 1 ELSE 0 END,
+            on_hold = on_hold
+                + CASE WHEN :new_status = 'On-Hold' THEN 1 ELSE 0 END
+                - CASE WHEN :old_status = 'On-Hold' THEN 1 ELSE 0 END,
+            dropped = dropped
+                + CASE WHEN :new_status = 'Dropped' THEN 1 ELSE 0 END
+                - CASE WHEN :old_status = 'Dropped' THEN 1 ELSE 0 END,
+            plan_to_watch = plan_to_watch
+                + CASE WHEN :new_status = 'Plan to Watch' THEN 1 ELSE 0 END
+                - CASE WHEN :old_status = 'Plan to Watch' THEN 1 ELSE 0 END
+        WHERE user_id = :user_id
+    """
+    database.session.execute(
+        sql, {"user_id": user_id, "old_status": old_status, "new_status": new_status}
+    )
+
+
+def rebuild_stats() -> None:
+    database.session.execute("DELETE FROM user_tag_stats")
+    database.session.execute("DELETE FROM user_stats")
+    database.session.execute("DELETE FROM anime_stats")
+
+    sql = """
+        INSERT INTO user_stats
+            (user_id, total, completed, watching, on_hold, dropped, plan_to_watch)
+        SELECT
+            user_id,
+            COUNT(*),
+            COUNT(CASE WHEN status = 'Completed' THEN 1 END),
+            COUNT(CASE WHEN status = 'Watching' THEN 1 END),
+            COUNT(CASE WHEN status = 'On-Hold' THEN 1 END),
+            COUNT(CASE WHEN status = 'Dropped' THEN 1 END),
+            COUNT(CASE WHEN status = 'Plan to Watch' THEN 1 END)
+        FROM list
+        GROUP BY user_id
+    """
+    database.session.execute(sql)
+
+    sql = """
+        INSERT INTO user_tag_stats (user_id, tag, count, score_sum, score_count)
+        SELECT l.user_id, t.tag, COUNT(l.id), COALESCE(SUM(l.score), 0), COUNT(l.score)
+        FROM list l, tags t
+        WHERE t.anime_id = l.anime_id
+        GROUP BY l.user_id, t.tag
+    """
+    database.session.execute(sql)
+
+    sql = """
+        INSERT INTO anime_stats (anime_id, list_count, score_sum, score_count)
+        SELECT anime_id, COUNT(*), COALESCE(SUM(score), 0), COUNT(score)
+        FROM list
+        GROUP BY anime_id
+    """
+    database.session.execute(sql)
+    database.session.commit()
+
+
+def get_counts(user_id: int) -> dict:
+    sql = """
+        SELECT total, completed, watching, on_hold, dropped, plan_to_watch
+        FROM user_stats
+        WHERE user_id = :user_id
+    """
+    row = database.session.execute(sql, {"user_id": user_id}).fetchone()
+    row = row if row else (0, 0, 0, 0, 0, 0)
+    return {
+        "total": row[0],
+        "completed": row[1],
+        "watching": row[2],
+        "on_hold": row[3],
+        "dropped": row[4],
+        "plan_to_watch": row[5],
+    }
+
+
+def get_watched_tags(user_id: int) -> list:
+    sql = """
+        SELECT tag, count
+        FROM user_tag_stats
+        WHERE user_id = :user_id
+        ORDER BY count DESC, tag
+    """
+    return database.session.execute(sql, {"user_id": user_id}).fetchall()
+
+
+def get_popular_tags(user_id: int) -> list:
+    sql = """
+        SELECT tag, ROUND(score_sum::NUMERIC / NULLIF(score_count, 0), 2)
+        FROM user_tag_stats
+        WHERE user_id = :user_id
+        ORDER BY COALESCE(score_sum::NUMERIC / NULLIF(score_count, 0), 0) DESC, tag
+    """
+    return database.session.execute(sql, {"user_id": user_id}).fetchall()
@@ -1,33 +1,44 @@
+import response_cache
 from database import database
 
+# The SQL of the tag reads is shared with the async JSON API in api.py
+TAGS_SQL = """
+    SELECT t.tag FROM tags t, anime a
+    WHERE a.id = t.anime_id AND a.id = :anime_id
+    ORDER BY t.tag
+"""
+
+TAG_COUNTS_SQL = """
+    SELECT t.tag, COUNT(a.id)
+    FROM tags t
+        LEFT JOIN anime a ON a.id = t.anime_id
+    GROUP BY t.tag
+    ORDER BY COUNT(a.id) DESC, t.tag
+"""
+
+POPULAR_TAGS_SQL = """
+    SELECT t.tag,
+        ROUND(SUM(st.score_sum)::NUMERIC / NULLIF(SUM(st.score_count), 0), 2)
+    FROM tags t
+        LEFT JOIN anime_stats st ON st.anime_id = t.anime_id
+    GROUP BY t.tag
+    ORDER BY
+        COALESCE(SUM(st.score_sum)::NUMERIC / NULLIF(SUM(st.score_count), 0), 0) DESC,
+        COALESCE(SUM(st.list_count), 0) DESC,
+        t.tag
+"""
+
 
 def get_tags(anime_id: int) -> list:
-    sql = """
-        SELECT t.tag FROM tags t, anime a
-        WHERE a.id = t.anime_id AND a.id = :anime_id
-        ORDER BY t.tag
-    """
-    result = database.session.execute(sql, {"anime_id": anime_id})
+    result = database.session.execute(TAGS_SQL, {"anime_id": anime_id})
     return [row[0] for row in result.fetchall()]
 
 
+@response_cache.shared_read()
 def get_tag_counts() -> list:
-    sql = """
-        SELECT t.tag, COUNT(a.id)
-        FROM tags t
-            LEFT JOIN anime a ON a.id = t.anime_id
-        GROUP BY t.tag
-        ORDER BY COUNT(a.id) DESC, t.tag
-    """
-    return database.session.execute(sql).fetchall()
+    return database.session.execute(TAG_COUNTS_SQL).fetchall()
 
 
+@response_cache.shared_read("scores")
 def get_popular_tags() -> list:
-    sql = """
-        SELECT t.tag, ROUND(AVG(l.score), 2)
-        FROM tags t
-            LEFT JOIN list l ON l.anime_id = t.anime_id
-        GROUP BY t.tag
-        ORDER BY COALESCE(AVG(l.score), 0) DESC, COUNT(l.user_id) DESC, t.tag
-    """
-    return database.session.execute(sql).fetchall()
+    return database.session.execute(POPULAR_TAGS_SQL).fetchall()
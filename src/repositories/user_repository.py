@@ -1,34 +1,62 @@
+import os
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional
 
 from flask import session
-from werkzeug.security import check_password_hash, generate_password_hash
 
+import response_cache
 from database import database
 
 
-def check_password(username: str, password: str) -> bool:
-    sql = "SELECT password FROM users WHERE username = :username"
-    result = database.session.execute(sql, {"username": username})
-    password_hash = result.fetchone()[0]
-    return check_password_hash(password_hash, password)
+def get_login_data(username: str) -> Optional[tuple[int, bool, str]]:
+    sql = "SELECT id, show_hidden, password FROM users WHERE username = :username"
+    row = database.session.execute(sql, {"username": username}).fetchone()
+    return None if not row else (row[0], row[1], row[2])
 
 
 def username_taken(username: str) -> bool:
+    # Uses the unique index on LOWER(username)
     sql = "SELECT COUNT(*) FROM users WHERE LOWER(username) = LOWER(:username)"
     result = database.session.execute(sql, {"username": username})
     return result.fetchone()[0] > 0
 
 
-def username_exists(username: str) -> bool:
-    sql = "SELECT COUNT(*) FROM users WHERE username = :username"
-    result = database.session.execute(sql, {"username": username})
-    return result.fetchone()[0] > 0
+# Users are looked up by username on every list and profile page, so found
+# users are cached per process. Entries expire after USER_CACHE_SECONDS because
+# settings changes are only seen immediately by the worker that handled them.
+user_cache = OrderedDict()
+user_cache_lock = threading.Lock()
+user_cache_size = int(os.getenv("USER_CACHE_SIZE", "10000"))
+user_cache_seconds = float(os.getenv("USER_CACHE_SECONDS", "60"))
+
+# Shared with the async JSON API in api.py
+USER_DATA_SQL = "SELECT id, show_hidden FROM users WHERE username = :username"
 
 
 def get_user_data(username: str) -> Optional[tuple[int, bool]]:
-    sql = "SELECT id, show_hidden FROM users WHERE username = :username"
-    result = database.session.execute(sql, {"username": username})
-    return result.fetchone()
+    settings_version = response_cache.version("user-settings")
+    with user_cache_lock:
+        entry = user_cache.get(username)
+        if (
+            entry is not None
+            and entry[1] == settings_version
+            and time.monotonic() - entry[2] < user_cache_seconds
+        ):
+            user_cache.move_to_end(username)
+            return entry[0]
+
+    row = database.session.execute(USER_DATA_SQL, {"username": username}).fetchone()
+    if not row:
+        return None
+    data = (row[0], row[1])
+    with user_cache_lock:
+        user_cache[username] = (data, settings_version, time.monotonic())
+        user_cache.move_to_end(username)
+        while len(user_cache) > user_cache_size:
+            user_cache.popitem(last=False)
+    return data
 
 
 def set_show_hidden(new_show_hidden: bool) -> None:
@@ -37,13 +65,14 @@ def set_show_hidden(new_show_hidden: bool) -> None:
         sql, {"user_id": session["user_id"], "show_hidden": new_show_hidden}
     )
     database.session.commit()
+    response_cache.invalidate("user-settings")
 
 
-def add_user(username: str, password: str) -> int:
-    password_hash = generate_password_hash(password)
+def add_user(username: str, password_hash: str) -> int:
     sql = "INSERT INTO users (username, password) VALUES (:username, :password) RETURNING id"
     result = database.session.execute(
         sql, {"username": username, "password": password_hash}
     )
     database.session.commit()
+    response_cache.invalidate("users")
     return result.fetchone()[0]
@@ -0,0 +1,55 @@
+from copy import deepcopy
+from functools import wraps
+from typing import Callable
+
+from flask import Response, current_app, g, has_request_context
+
+# Repository reads decorated with reads() are memoized for the duration of a
+# request. Functions decorated with writes() drop the memoized results of the
+# groups they change. Results are copied because callers may modify them.
+
+
+def reads(group: str) -> Callable:
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args):
+            if not has_request_context():
+                return function(*args)
+
+            if "memo" not in g:
+                g.memo = {}
+                g.saved_queries = 0
+            results = g.memo.setdefault(group, {})
+            key = (function.__qualname__, function.__module__, args)
+            if key in results:
+                g.saved_queries += 1
+                return deepcopy(results[key])
+
+            result = function(*args)
+            results[key] = deepcopy(result)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def writes(group: str) -> Callable:
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            try:
+                return function(*args, **kwargs)
+            finally:
+                if has_request_context() and "memo" in g:
+                    g.memo.pop(group, None)
+
+        return wrapper
+
+    return decorator
+
+
+def log_saved_queries(response: Response) -> Response:
+    if g.get("saved_queries"):
+        current_app.logger.debug("Memoization saved %d queries", g.saved_queries)
+    return response
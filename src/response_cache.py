@@ -0,0 +1,361 @@
+import fcntl
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import Callable, Iterator, Optional
+
+from flask import current_app, g, make_response, request, session
+
+import query_timeout
+
+# Cached pages are tagged with the data they depend on. Writing that data bumps
+# the tag's version and every entry stored with an older version becomes stale.
+# With RESPONSE_CACHE_DIR set, versions and pages are shared between workers
+# through the filesystem, otherwise they are local to the process.
+# Concurrent misses for the same page are coalesced: one request renders it
+# while the others wait for the result, across workers too with the file cache.
+# Stale entries are kept, so they can be served when rendering times out.
+# Repository reads that don't depend on the user are shared the same way with
+# shared_read(), so logged in requests, which aren't cached, coalesce too.
+
+
+class CacheEntry:
+    __slots__ = ("body", "etag", "created", "versions")
+
+    def __init__(self, body: bytes, etag: str, created: float, versions: dict):
+        self.body = body
+        self.etag = etag
+        self.created = created
+        self.versions = versions
+
+
+class LRUCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        if len(entry.body) > self.max_bytes:
+            return
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = entry
+            self.size += len(entry.body)
+            while self.size > self.max_bytes:
+                _, oldest = self.entries.popitem(last=False)
+                self.size -= len(oldest.body)
+
+    def delete(self, key: str) -> None:
+        with self.lock:
+            self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry.body)
+
+
+class Flight:
+    __slots__ = ("lock", "requests")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+
+
+class FileCache:
+    # Pages past max_files are removed oldest first. Keys share 4096 lock
+    # files, so the lock files never need to be removed.
+    PRUNE_INTERVAL = 100
+    LOCK_PREFIX_LENGTH = 3
+
+    def __init__(self, directory: str, max_files: int):
+        self.directory = directory
+        self.max_files = max_files
+        self.sets = 0
+        os.makedirs(os.path.join(directory, "pages"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "tags"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "locks"), exist_ok=True)
+
+    def _page_path(self, key: str) -> str:
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "pages", name)
+
+    def _lock_path(self, key: str) -> str:
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, "locks", name[: self.LOCK_PREFIX_LENGTH])
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        try:
+            with open(self._page_path(key), "rb") as file:
+                return pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        path = self._page_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temp_path, "wb") as file:
+            pickle.dump(entry, file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        self.sets += 1
+        if self.sets % self.PRUNE_INTERVAL == 0:
+            self.prune()
+
+    def prune(self) -> None:
+        pages = []
+        with os.scandir(os.path.join(self.directory, "pages")) as entries:
+            for entry in entries:
+                try:
+                    pages.append((entry.stat().st_mtime, entry.path))
+                except OSError:
+                    pass
+        if len(pages) <= self.max_files:
+            return
+        # Leave some room, so the next sets don't prune again right away
+        pages.sort()
+        for _, path in pages[: len(pages) - self.max_files * 9 // 10]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._page_path(key))
+        except OSError:
+            pass
+
+    @contextmanager
+    def lock(self, key: str, timeout: float) -> Iterator[None]:
+        # flock is released when the file is closed, also if the worker dies
+        with open(self._lock_path(key), "a", encoding="utf-8") as file:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() > deadline:
+                        break
+                    time.sleep(0.01)
+            yield
+
+    def version(self, tag: str) -> int:
+        try:
+            return os.stat(os.path.join(self.directory, "tags", tag)).st_mtime_ns
+        except OSError:
+            return 0
+
+    def bump(self, tag: str) -> None:
+        path = os.path.join(self.directory, "tags", tag)
+        with open(path, "a", encoding="utf-8"):
+            pass
+        new_version = max(time.time_ns(), self.version(tag) + 1)
+        os.utime(path, ns=(new_version, new_version))
+
+
+memory_cache = LRUCache(int(os.getenv("RESPONSE_CACHE_BYTES", str(32 * 1024**2))))
+file_cache = (
+    FileCache(
+        os.getenv("RESPONSE_CACHE_DIR"), int(os.getenv("RESPONSE_CACHE_FILES", "10000"))
+    )
+    if os.getenv("RESPONSE_CACHE_DIR")
+    else None
+)
+max_age = int(os.getenv("RESPONSE_CACHE_SECONDS", "300"))
+coalesce_timeout = float(os.getenv("RESPONSE_CACHE_COALESCE_SECONDS", "10"))
+# Shared reads are only reused by requests that coalesced with the one reading
+shared_read_age = 2
+local_versions = {}
+local_versions_lock = threading.Lock()
+flights = {}
+flights_lock = threading.Lock()
+
+
+def version(tag: str) -> int:
+    if file_cache:
+        return file_cache.version(tag)
+    return local_versions.get(tag, 0)
+
+
+def invalidate(*tags: str) -> None:
+    for tag in tags:
+        if file_cache:
+            file_cache.bump(tag)
+        else:
+            with local_versions_lock:
+                local_versions[tag] = local_versions.get(tag, 0) + 1
+
+
+def invalidate_list_write(user_id: int) -> None:
+    invalidate(f"list-{user_id}")
+
+
+def invalidate_score_write(user_id: int, anime_id: int) -> None:
+    # Entries that change the anime's list count or score sum
+    invalidate("scores", f"list-{user_id}", f"anime-{anime_id}")
+
+
+def depends_on(*tags: str) -> None:
+    # Route level dependencies that are only known after looking up data
+    if "cache_versions" in g:
+        for tag in tags:
+            g.cache_versions[tag] = version(tag)
+
+
+def is_fresh(entry: CacheEntry, seconds: Optional[float] = None) -> bool:
+    seconds = max_age if seconds is None else seconds
+    return time.time() - entry.created < seconds and all(
+        version(tag) == tag_version for tag, tag_version in entry.versions.items()
+    )
+
+
+def get_entry(
+    key: str, allow_stale: bool = False, seconds: Optional[float] = None
+) -> Optional[CacheEntry]:
+    entry = memory_cache.get(key)
+    if file_cache and (entry is None or not is_fresh(entry, seconds)):
+        # Another worker may have stored a newer version
+        file_entry = file_cache.get(key)
+        if file_entry is not None:
+            entry = file_entry
+            memory_cache.set(key, entry)
+    if entry is not None and not allow_stale and not is_fresh(entry, seconds):
+        return None
+    return entry
+
+
+def get_timed_out_entry(key: str) -> Optional[CacheEntry]:
+    # The expired copy, if rendering the page ran out of time a moment ago
+    marker = get_entry(f"{key}|timeout", allow_stale=True)
+    if marker is None or time.time() - marker.created > coalesce_timeout:
+        return None
+    return get_entry(key, allow_stale=True)
+
+
+def set_entry(key: str, entry: CacheEntry) -> None:
+    memory_cache.set(key, entry)
+    if file_cache:
+        file_cache.set(key, entry)
+
+
+@contextmanager
+def single_flight(key: str) -> Iterator[None]:
+    # Waiting stops after coalesce_timeout, then the page is rendered anyway
+    with flights_lock:
+        flight = flights.setdefault(key, Flight())
+        flight.requests += 1
+    acquired = flight.lock.acquire(timeout=coalesce_timeout)
+    try:
+        with file_cache.lock(key, coalesce_timeout) if file_cache else nullcontext():
+            yield
+    finally:
+        if acquired:
+            flight.lock.release()
+        with flights_lock:
+            flight.requests -= 1
+            if not flight.requests:
+                del flights[key]
+
+
+def shared_read(*tags: str) -> Callable:
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args):
+            if not current_app.config.get("RESPONSE_CACHE", True):
+                return function(*args)
+
+            name = f"{function.__module__}.{function.__name__}{args!r}"
+            key = f"read|{hashlib.sha1(name.encode('utf-8')).hexdigest()}"
+            entry = get_entry(key, seconds=shared_read_age)
+            if entry is None:
+                with single_flight(key):
+                    entry = get_entry(key, seconds=shared_read_age)
+                    if entry is None:
+                        versions = {tag: version(tag) for tag in tags}
+                        body = pickle.dumps(function(*args), pickle.HIGHEST_PROTOCOL)
+                        entry = CacheEntry(body, "", time.time(), versions)
+                        set_entry(key, entry)
+            return pickle.loads(entry.body)
+
+        return wrapper
+
+    return decorator
+
+
+def is_cacheable() -> bool:
+    return (
+        current_app.config.get("RESPONSE_CACHE", True)
+        and request.method == "GET"
+        and "user_id" not in session
+        and "_flashes" not in session
+    )
+
+
+def render_entry(key: str, tags: tuple, view: Callable, *args, **kwargs):
+    # Versions are read before the data so a concurrent write makes the stored
+    # entry stale instead of being lost
+    g.cache_versions = {tag: version(tag) for tag in tags}
+    try:
+        body = view(*args, **kwargs)
+    except query_timeout.QueryTimeout:
+        entry = get_entry(key, allow_stale=True)
+        if entry is None:
+            raise
+        # Requests waiting for this one get the expired copy too, instead of
+        # running out of time one after another
+        set_entry(f"{key}|timeout", CacheEntry(b"", "", time.time(), {}))
+        return entry
+    if not isinstance(body, str):
+        return body
+    body = body.encode("utf-8")
+    entry = CacheEntry(
+        body, hashlib.sha1(body).hexdigest(), time.time(), g.cache_versions
+    )
+    set_entry(key, entry)
+    return entry
+
+
+def cached(*tags: str) -> Callable:
+    def decorator(view: Callable) -> Callable:
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not is_cacheable():
+                return view(*args, **kwargs)
+
+            key = f"{request.full_path}|{session.get('show_hidden', False)}"
+            entry = get_entry(key)
+            if entry is None:
+                with single_flight(key):
+                    entry = get_entry(key) or get_timed_out_entry(key)
+                    if entry is None:
+                        entry = render_entry(key, tags, view, *args, **kwargs)
+                        if not isinstance(entry, CacheEntry):
+                            return entry
+
+            response = make_response(entry.body)
+            # Weak, so the tag still matches when the response is compressed
+            response.set_etag(entry.etag, weak=True)
+            response.last_modified = entry.created
+            response.headers["Cache-Control"] = "no-cache"
+            response.vary.add("Cookie")
+            return response.make_conditional(request)
+
+        return wrapper
+
+    return decorator
@@ -1,22 +1,38 @@
 import urllib.parse
 from typing import Union
 
-from flask import Response, abort, flash, redirect, render_template, request, session
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    flash,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    session,
+    stream_with_context,
+)
 from markupsafe import Markup
 
-from app import app
+import query_timeout
+import response_cache
+import search_index
 from repositories import (
     anime_repository,
     list_repository,
     relation_repository,
+    stats_repository,
     tag_repository,
     user_repository,
 )
 from services import list_service, user_service
 
+blueprint = Blueprint("routes", __name__)
+
 
 # Url encoder
-@app.template_filter("urlencode")
+@blueprint.app_template_filter("urlencode")
 def url_encode(string: str) -> Markup:
     if isinstance(string, Markup):
         string = string.unescape()
@@ -26,40 +42,67 @@ def url_encode(string: str) -> Markup:
 
 
 # /
-@app.route("/")
+@blueprint.route("/")
 def index() -> str:
     return render_template("index.html")
 
 
 # /list
-@app.route("/list/<path:username>", methods=["GET"])
+def get_list_args() -> tuple:
+    tag = request.args["tag"] if "tag" in request.args else ""
+    status = request.args["status"] if "status" in request.args else "All"
+    sort = request.args["sort"] if "sort" in request.args else "title"
+    sort = sort if sort in list_repository.LIST_SORTS else "title"
+    after = request.args["after"] if "after" in request.args else ""
+    after = int(after) if after.isdigit() else None
+    return tag, status, sort, after
+
+
+@blueprint.route("/list/<path:username>", methods=["GET"])
+@response_cache.cached("users")
+@query_timeout.statement_timeout(2000)
 def list_get(username: str) -> Union[str, Response]:
     data = user_repository.get_user_data(username)
     if not data:
         return "<h1>No user found<h1>"
     user_id, _ = user_repository.get_user_data(username)
+    response_cache.depends_on(f"list-{user_id}")
     own_profile = "user_id" in session and session["user_id"] == user_id
 
-    tag = request.args["tag"] if "tag" in request.args else ""
-    status = request.args["status"] if "status" in request.args else "All"
-    list_data = list_repository.get_list_data(user_id, status, tag)
-    base_url = f"/list/{url_encode(username)}?"
-    status_url = f"{base_url}status={status}"
-    base_url = base_url if not tag else f"{base_url}tag={tag}&"
+    tag, status, sort, after = get_list_args()
+    list_data = list_repository.get_list_data(
+        user_id, status, tag, sort, after, list_repository.LIST_PAGE_SIZE + 1
+    )
+    has_next = len(list_data) > list_repository.LIST_PAGE_SIZE
+    list_data = list_data[: list_repository.LIST_PAGE_SIZE]
+    list_count = list_repository.get_list_count(user_id, status, tag)
+
+    list_url = f"/list/{url_encode(username)}?"
+    tag_query = "" if not tag else f"tag={url_encode(tag)}&"
+    status_query = f"status={url_encode(status)}"
+    base_url = f"{list_url}sort={sort}&{tag_query}"
+    status_url = f"{list_url}sort={sort}&{status_query}"
+    sort_url = f"{list_url}{tag_query}{status_query}&sort="
+    current_url = f"{base_url}{status_query}"
 
     return render_template(
         "list.html",
         base_url=base_url,
         status_url=status_url,
+        sort_url=sort_url,
+        first_url=current_url if after else "",
+        next_url=f"{current_url}&after={list_data[-1]['id']}" if has_next else "",
         tag=tag,
+        sort=sort,
         username=username,
         own_profile=own_profile,
         list_data=list_data,
+        list_count=list_count,
         status=status,
     )
 
 
-@app.route("/list/<path:username>", methods=["POST"])
+@blueprint.route("/list/<path:username>", methods=["POST"])
 def list_post(username: str) -> Union[str, Response]:
     data = user_repository.get_user_data(username)
     if not data:
@@ -71,9 +114,11 @@ def list_post(username: str) -> Union[str, Response]:
     if "user_id" not in session or session["user_id"] != user_id:
         abort(403)
 
-    tag = request.args["tag"] if "tag" in request.args else ""
-    status = request.args["status"] if "status" in request.args else "All"
-    list_data = list_repository.get_list_data(user_id, status, tag)
+    # Only the page that was shown is updated
+    tag, status, sort, after = get_list_args()
+    list_data = list_repository.get_list_data(
+        user_id, status, tag, sort, after, list_repository.LIST_PAGE_SIZE
+    )
 
     # Handle list data change
     for anime in list_data:
@@ -92,8 +137,30 @@ def list_post(username: str) -> Union[str, Response]:
     return list_get(username)
 
 
+@blueprint.route("/list/<path:username>/export", methods=["GET"])
+def list_export(username: str) -> Union[str, Response]:
+    data = user_repository.get_user_data(username)
+    if not data:
+        return "<h1>No user found<h1>"
+    user_id, _ = data
+
+    export_format = request.args["format"] if "format" in request.args else "xml"
+    if export_format not in list_service.EXPORT_FORMATS:
+        abort(400)
+    mimetype, extension = list_service.EXPORT_FORMATS[export_format]
+
+    # Rows are sent as they are read from the database
+    return Response(
+        stream_with_context(list_service.export_list(user_id, export_format)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=animelist.{extension}"},
+    )
+
+
 # /tags
-@app.route("/tags")
+@blueprint.route("/tags")
+@response_cache.cached("scores")
+@query_timeout.statement_timeout(3000)
 def tags_get() -> str:
     popular_tags = tag_repository.get_popular_tags()
     tag_counts = tag_repository.get_tag_counts()
@@ -103,47 +170,91 @@ def tags_get() -> str:
 
 
 # /topanime
-@app.route("/topanime", methods=["GET"])
+@blueprint.route("/topanime", methods=["GET"])
+@response_cache.cached("scores")
+@query_timeout.statement_timeout(3000)
 def topanime_get() -> str:
-    list_ids = []
-    if "user_id" in session:
-        list_ids = list_repository.get_list_ids(session["user_id"])
-
     related = request.args["related"] if "related" in request.args else ""
-    tag = request.args["tag"].lower() if "tag" in request.args else ""
     query = request.args["query"] if "query" in request.args else ""
+    filters = [
+        (name, value.lower())
+        for name in ("tag", "any_tag", "not_tag")
+        for value in request.args.getlist(name)
+        if value
+    ]
     page = 0
     if "page" in request.args and request.args["page"].isdigit():
         page = int(request.args["page"])
 
-    if not related:
+    facets = []
+    # The unfiltered catalog is served by the database
+    index = search_index.get_index() if not related and (query or filters) else None
+    if index:
+        tags = {name: [] for name in ("tag", "any_tag", "not_tag")}
+        for name, value in filters:
+            tags[name].append(value)
+        bitmap = index.filter(
+            query,
+            tags["tag"],
+            tags["any_tag"],
+            tags["not_tag"],
+            session.get("show_hidden", False),
+        )
+        facets = index.cached_facets(
+            (query.lower(), tuple(filters), session.get("show_hidden", False)),
+            bitmap,
+            (value for _, value in filters),
+        )
+    if index:
+        anime_ids = index.ids(bitmap)
+        anime_count = len(anime_ids)
+        top_anime = anime_repository.get_top_anime_by_ids(page, anime_ids)
+    elif not related:
+        # Without the search index only a single tag is supported
+        filters = [(name, value) for name, value in filters if name == "tag"][:1]
+        tag = filters[0][1] if filters else ""
         anime_count = anime_repository.anime_count(query, tag)
         top_anime = anime_repository.get_top_anime(page, query, tag)
     else:
         user_service.check_user()
         anime_count = relation_repository.related_anime_count(session["user_id"])
         top_anime = relation_repository.get_related_anime(page, session["user_id"])
-        tag = ""
+        filters = []
         query = ""
     page = max(0, min(anime_count - 50, page))
     prev_page = max(page - 50, 0)
     next_page = min(page + 50, max(0, anime_count - 50))
 
+    # The first tag is edited in the search form, other filters are kept
+    tag = filters[0][1] if filters and filters[0][0] == "tag" else ""
+    extra_filters = filters[1:] if tag else filters
+
     # Base url and current url
-    base_url = "/topanime?" if not query else f"/topanime?query={query}&"
-    if tag:
-        base_url += f"tag={url_encode(tag)}&"
+    base_url = "/topanime?" if not query else f"/topanime?query={url_encode(query)}&"
+    for name, value in filters:
+        base_url += f"{name}={url_encode(value)}&"
     if related:
         base_url += "related=on&"
     current_url = base_url if page == 0 else f"{base_url}page={page}"
 
+    # Urls for removing a filter
+    filter_urls = []
+    for i, (name, value) in enumerate(filters):
+        url = "/topanime?" if not query else f"/topanime?query={url_encode(query)}&"
+        for other_name, other_value in filters[:i] + filters[i + 1 :]:
+            url += f"{other_name}={url_encode(other_value)}&"
+        filter_urls.append((name, value, url))
+
     return render_template(
         "topanime.html",
         top_anime=top_anime,
         query=query,
         tag=tag,
+        extra_filters=extra_filters,
+        filter_urls=filter_urls if len(filters) > 1 else [],
+        facets=facets,
+        base_url=base_url,
         related=related,
-        list_ids=list_ids,
         current_url=current_url,
         prev_url=f"{base_url}page={prev_page}",
         next_url=f"{base_url}page={next_page}",
@@ -152,7 +263,7 @@ def topanime_get() -> str:
     )
 
 
-@app.route("/topanime", methods=["POST"])
+@blueprint.route("/topanime", methods=["POST"])
 def topanime_post() -> str:
     user_service.check_user()
     user_service.check_csrf(request.form["csrf_token"])
@@ -161,9 +272,22 @@ def topanime_post() -> str:
     return topanime_get()
 
 
+# /autocomplete
+@blueprint.route("/autocomplete", methods=["GET"])
+def autocomplete_get() -> Response:
+    query = request.args["query"] if "query" in request.args else ""
+    index = search_index.get_index()
+    if index:
+        return jsonify(index.autocomplete(query, session.get("show_hidden", False)))
+    return jsonify(anime_repository.autocomplete(query) if query else [])
+
+
 # /anime/id
-@app.route("/anime/<int:anime_id>", methods=["GET"])
+@blueprint.route("/anime/<int:anime_id>", methods=["GET"])
+@response_cache.cached()
+@query_timeout.statement_timeout(1000)
 def anime_get(anime_id: int) -> str:
+    response_cache.depends_on(f"anime-{anime_id}")
     anime = anime_repository.get_anime(anime_id)
     if not anime:
         return render_template("anime.html", anime=anime)
@@ -174,6 +298,7 @@ def anime_get(anime_id: int) -> str:
         user_data = new_data if new_data else user_data
 
     related_anime = relation_repository.get_anime_related_anime(anime_id)
+    response_cache.depends_on(*[f"anime-{related['id']}" for related in related_anime])
     anime_tags = tag_repository.get_tags(anime_id)
 
     return render_template(
@@ -185,7 +310,7 @@ def anime_get(anime_id: int) -> str:
     )
 
 
-@app.route("/anime/<int:anime_id>", methods=["POST"])
+@blueprint.route("/anime/<int:anime_id>", methods=["POST"])
 def anime_post(anime_id: int) -> str:
     user_service.check_user()
     user_service.check_csrf(request.form["csrf_token"])
@@ -221,19 +346,19 @@ def anime_post(anime_id: int) -> str:
 
 
 # /profile
-@app.route("/profile/<path:username>", methods=["GET"])
+@blueprint.route("/profile/<path:username>", methods=["GET"])
 def profile_get(username: str) -> str:
     data = user_repository.get_user_data(username)
     if not data:
         return "<h1>No user found<h1>"
     user_id, _ = data
     own_profile = "user_id" in session and session["user_id"] == user_id
-    counts = list_repository.get_counts(user_id)
+    counts = stats_repository.get_counts(user_id)
     tags = request.args["tags"] if "tags" in request.args else ""
     if tags != "top":
-        sorted_tags = list_repository.get_watched_tags(user_id)
+        sorted_tags = stats_repository.get_watched_tags(user_id)
     else:
-        sorted_tags = list_repository.get_popular_tags(user_id)
+        sorted_tags = stats_repository.get_popular_tags(user_id)
     return render_template(
         "profile.html",
         tags=tags,
@@ -245,7 +370,7 @@ def profile_get(username: str) -> str:
     )
 
 
-@app.route("/profile/<path:username>", methods=["POST"])
+@blueprint.route("/profile/<path:username>", methods=["POST"])
 def profile_post(username: str) -> str:
     data = user_repository.get_user_data(username)
     if not data:
@@ -274,7 +399,7 @@ def profile_post(username: str) -> str:
 
 
 # /login
-@app.route("/login", methods=["GET", "POST"])
+@blueprint.route("/login", methods=["GET", "POST"])
 def login() -> Union[str, Response]:
     username = ""
     password = ""
@@ -294,7 +419,7 @@ def login() -> Union[str, Response]:
 
 
 # /register
-@app.route("/register", methods=["GET", "POST"])
+@blueprint.route("/register", methods=["GET", "POST"])
 def register() -> Union[str, Response]:
     username = ""
     password1 = ""
@@ -316,7 +441,7 @@ def register() -> Union[str, Response]:
 
 
 # /logout
-@app.route("/logout")
+@blueprint.route("/logout")
 def logout() -> Response:
     user_service.logout()
     flash("Logged out")
@@ -0,0 +1,261 @@
+import sys
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from os import getenv
+from typing import Iterable, Iterator, Optional
+
+from database import database
+from repositories import anime_repository
+
+# Optional in-process replacement for the ILIKE title and synonym search. The
+# catalog is loaded from the database on first use and reloaded when the import
+# generation changes. Names are indexed by their trigrams, so a substring search
+# only has to check names that contain every trigram of the query. Tags and the
+# hidden flag are bitmaps stored in ints where bit n is the nth record, so tag
+# filters and facet counts are bitwise operations. Small results count their
+# facets from the tags of each record instead.
+
+FACET_CACHE_SIZE = 1024
+SMALL_RESULT_SIZE = 2000
+
+
+class AnimeRecord:
+    __slots__ = ("id", "title", "hidden")
+
+    def __init__(self, anime_id: int, title: str, hidden: bool):
+        self.id = anime_id
+        self.title = title
+        self.hidden = hidden
+
+
+def trigrams(name: str) -> set:
+    return {name[i : i + 3] for i in range(len(name) - 2)}
+
+
+def popcount(bitmap: int) -> int:
+    return bin(bitmap).count("1")
+
+
+def to_bitmap(positions: Iterable[int], size: int) -> int:
+    data = bytearray((size + 7) // 8)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, "little")
+
+
+def from_bitmap(bitmap: int) -> Iterator[int]:
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    for byte_index, byte in enumerate(data):
+        if byte:
+            for bit in range(8):
+                if byte >> bit & 1:
+                    yield byte_index * 8 + bit
+
+
+class SearchIndex:
+    def __init__(self, generation: Optional[str]):
+        self.generation = generation
+        self.records = []
+        self.positions = {}
+        self.names = []
+        self.name_owners = array("i")
+        self.postings = {}
+        self.tags = {}
+        self.record_tags = []
+        self.hidden = 0
+        self.all = 0
+        self.facet_cache = OrderedDict()
+        self.facet_lock = threading.Lock()
+
+    def add_anime(self, anime_id: int, title: str, hidden: bool) -> None:
+        self.positions[anime_id] = len(self.records)
+        self.records.append(AnimeRecord(anime_id, sys.intern(title), hidden))
+        self.record_tags.append([])
+        self.add_name(anime_id, title)
+
+    def add_name(self, anime_id: int, name: str) -> None:
+        position = self.positions.get(anime_id)
+        if position is None:
+            return
+        name = sys.intern(name.lower())
+        name_index = len(self.names)
+        self.names.append(name)
+        self.name_owners.append(position)
+        for gram in trigrams(name):
+            self.postings.setdefault(gram, []).append(name_index)
+
+    def add_tag(self, anime_id: int, tag: str) -> None:
+        position = self.positions.get(anime_id)
+        if position is not None:
+            tag = sys.intern(tag)
+            self.tags.setdefault(tag, []).append(position)
+            self.record_tags[position].append(tag)
+
+    def freeze(self) -> None:
+        size = len(self.records)
+        self.postings = {
+            gram: array("i", names) for gram, names in self.postings.items()
+        }
+        self.tags = {
+            tag: to_bitmap(positions, size) for tag, positions in self.tags.items()
+        }
+        self.record_tags = [tuple(tags) for tags in self.record_tags]
+        self.hidden = to_bitmap(
+            (i for i, record in enumerate(self.records) if record.hidden), size
+        )
+        self.all = (1 << size) - 1
+
+    def find_names(self, query: str) -> Iterable[int]:
+        grams = trigrams(query)
+        if not grams:
+            return (i for i, name in enumerate(self.names) if query in name)
+        postings = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+        return (i for i in candidates if query in self.names[i])
+
+    # Anime that have all of all_tags, one of any_tags, and none of no_tags
+    def filter(
+        self,
+        query: str,
+        all_tags: list,
+        any_tags: list,
+        no_tags: list,
+        show_hidden: bool,
+    ) -> int:
+        bitmap = self.all if show_hidden else self.all & ~self.hidden
+        for tag in all_tags:
+            bitmap &= self.tags.get(tag, 0)
+        if any_tags:
+            any_bitmap = 0
+            for tag in any_tags:
+                any_bitmap |= self.tags.get(tag, 0)
+            bitmap &= any_bitmap
+        for tag in no_tags:
+            bitmap &= ~self.tags.get(tag, 0)
+        if query and bitmap:
+            matches = {self.name_owners[i] for i in self.find_names(query.lower())}
+            bitmap &= to_bitmap(matches, len(self.records))
+        return bitmap
+
+    def ids(self, bitmap: int) -> list:
+        return [self.records[position].id for position in from_bitmap(bitmap)]
+
+    # Result count for every tag if it was added to the filters
+    def facets(self, bitmap: int, exclude: Iterable[str], limit: int = 20) -> list:
+        exclude = set(exclude)
+        if popcount(bitmap) <= SMALL_RESULT_SIZE:
+            tag_counts = Counter()
+            for position in from_bitmap(bitmap):
+                tag_counts.update(self.record_tags[position])
+            counts = (
+                (tag, count) for tag, count in tag_counts.items() if tag not in exclude
+            )
+        else:
+            counts = (
+                (tag, popcount(bitmap & tag_bitmap))
+                for tag, tag_bitmap in self.tags.items()
+                if tag not in exclude
+            )
+        return sorted(
+            (facet for facet in counts if facet[1]),
+            key=lambda facet: (-facet[1], facet[0]),
+        )[:limit]
+
+    # Facets of a filter, keyed by its query, tag filters and hidden flag. The
+    # cache lives as long as the index, so a new catalog generation starts empty.
+    def cached_facets(self, key: tuple, bitmap: int, exclude: Iterable[str]) -> list:
+        with self.facet_lock:
+            facets = self.facet_cache.get(key)
+            if facets is not None:
+                self.facet_cache.move_to_end(key)
+                return facets
+        facets = self.facets(bitmap, exclude)
+        with self.facet_lock:
+            self.facet_cache[key] = facets
+            if len(self.facet_cache) > FACET_CACHE_SIZE:
+                self.facet_cache.popitem(last=False)
+        return facets
+
+    def autocomplete(self, query: str, show_hidden: bool, limit: int = 10) -> list:
+        query = query.lower()
+        if not query:
+            return []
+        # Anime where any of the names starts with the query are listed first
+        records = {}
+        for i in self.find_names(query):
+            position = self.name_owners[i]
+            is_prefix = self.names[i].startswith(query)
+            records[position] = records.get(position, False) or is_prefix
+        positions = sorted(
+            (
+                position
+                for position in records
+                if show_hidden or not self.records[position].hidden
+            ),
+            key=lambda position: (
+                not records[position],
+                self.records[position].title,
+            ),
+        )[:limit]
+        return [
+            {"id": self.records[position].id, "title": self.records[position].title}
+            for position in positions
+        ]
+
+    def memory_usage(self) -> int:
+        size = sys.getsizeof(self.records) + sys.getsizeof(self.positions)
+        size += sum(
+            sys.getsizeof(record) + sys.getsizeof(record.title)
+            for record in self.records
+        )
+        size += sys.getsizeof(self.names) + sum(map(sys.getsizeof, self.names))
+        size += sys.getsizeof(self.name_owners) + sys.getsizeof(self.postings)
+        size += sum(
+            sys.getsizeof(gram) + sys.getsizeof(posting)
+            for gram, posting in self.postings.items()
+        )
+        size += sys.getsizeof(self.record_tags) + sum(
+            map(sys.getsizeof, self.record_tags)
+        )
+        size += sys.getsizeof(self.tags) + sys.getsizeof(self.hidden)
+        size += sys.getsizeof(self.all)
+        size += sum(
+            sys.getsizeof(tag) + sys.getsizeof(bitmap)
+            for tag, bitmap in self.tags.items()
+        )
+        return size
+
+
+def load(generation: Optional[str]) -> SearchIndex:
+    index = SearchIndex(generation)
+    for row in database.session.execute("SELECT id, title, hidden FROM anime"):
+        index.add_anime(row[0], row[1], row[2])
+    for row in database.session.execute("SELECT anime_id, synonym FROM synonyms"):
+        index.add_name(row[0], row[1])
+    for row in database.session.execute("SELECT anime_id, tag FROM tags"):
+        index.add_tag(row[0], row[1])
+    index.freeze()
+    return index
+
+
+enabled = getenv("SEARCH_INDEX") == "True"
+current_index = None
+load_lock = threading.Lock()
+
+
+def get_index() -> Optional[SearchIndex]:
+    global current_index  # pylint: disable=global-statement
+    if not enabled:
+        return None
+
+    generation = anime_repository.get_import_generation()
+    if current_index is None or current_index.generation != generation:
+        with load_lock:
+            if current_index is None or current_index.generation != generation:
+                current_index = load(generation)
+    return current_index
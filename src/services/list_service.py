@@ -1,6 +1,9 @@
-from typing import Optional
+import csv
+import io
+import json
+from typing import Iterator, Optional
+from xml.sax.saxutils import escape
 
-from defusedxml.ElementTree import ParseError, fromstring
 from flask import Response, abort, flash, session
 from werkzeug.datastructures import FileStorage
 
@@ -9,6 +12,10 @@ from repositories import anime_repository, list_repository
 
 # Helper functions
 def import_from_myanimelist(file: FileStorage) -> None:
+    # Only needed for imports, so it's not loaded when a worker starts
+    # pylint: disable=import-outside-toplevel
+    from defusedxml.ElementTree import ParseError, fromstring
+
     try:
         root = fromstring(file.read())
     except ParseError:
@@ -28,7 +35,11 @@ def import_from_myanimelist(file: FileStorage) -> None:
                     "status": node.find("./my_status").text,
                     "times_watched": int(node.find("./my_times_watched").text),
                 }
-                if anime["status"] == "Completed":
+                # Lists exported from here have the stored count of every anime
+                stored_times_watched = node.find("./times_watched")
+                if stored_times_watched is not None:
+                    anime["times_watched"] = int(stored_times_watched.text)
+                elif anime["status"] == "Completed":
                     anime["times_watched"] += 1
                 assert import_to_list(session["user_id"], anime)
             except (AttributeError, ValueError, AssertionError):
@@ -79,7 +90,7 @@ def handle_change(
 ) -> None:
     user_id = session["user_id"]
     user_data = list_repository.get_user_anime_data(user_id, anime_id)
-    anime = anime_repository.get_anime(anime_id)
+    episodes = anime_repository.get_episodes(anime_id)
 
     if (
         new_times_watched
@@ -93,7 +104,7 @@ def handle_change(
     if (
         new_episodes_watched
         and str.isdigit(new_episodes_watched)
-        and 0 <= int(new_episodes_watched) <= anime["episodes"]
+        and 0 <= int(new_episodes_watched) <= episodes
     ):
         new_episodes_watched = int(new_episodes_watched)
         if new_episodes_watched != user_data["episodes"]:
@@ -101,7 +112,7 @@ def handle_change(
             list_repository.set_episodes_watched(
                 user_id, anime_id, new_episodes_watched
             )
-            if new_episodes_watched == anime["episodes"]:
+            if new_episodes_watched == episodes:
                 list_repository.set_status(user_id, anime_id, "Completed")
                 list_repository.add_times_watched(user_id, anime_id, 1)
             else:
@@ -110,13 +121,78 @@ def handle_change(
     if new_status in ["Completed", "Watching", "On-Hold", "Dropped", "Plan to Watch"]:
         if new_status != user_data["status"]:
             list_repository.set_status(user_id, anime_id, new_status)
-            if new_status == "Completed" and user_data["episodes"] != anime["episodes"]:
-                list_repository.set_episodes_watched(
-                    user_id, anime_id, anime["episodes"]
-                )
+            if new_status == "Completed" and user_data["episodes"] != episodes:
+                list_repository.set_episodes_watched(user_id, anime_id, episodes)
                 list_repository.add_times_watched(user_id, anime_id, 1)
 
     if new_score == "None" or (str.isdigit(new_score) and 1 <= int(new_score) <= 10):
         new_score = None if new_score == "None" else int(new_score)
         if new_score != user_data["score"]:
             list_repository.set_score(user_id, anime_id, new_score)
+
+
+# Export
+EXPORT_FORMATS = {
+    "xml": ("application/xml", "xml"),
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+EXPORT_FIELDS = (
+    "series_animedb_id",
+    "series_title",
+    "series_episodes",
+    "my_watched_episodes",
+    "my_score",
+    "my_status",
+    "my_times_watched",
+    "times_watched",
+)
+
+
+def export_row(anime: dict) -> dict:
+    # MyAnimeList counts only the rewatches of completed anime, so the first
+    # watch is subtracted here. That can't be told apart from no watches, so
+    # the stored count is exported too, and the importer uses it when present
+    times_watched = anime["times_watched"]
+    if anime["status"] == "Completed":
+        times_watched = max(0, times_watched - 1)
+    return {
+        "series_animedb_id": anime["link"].rstrip("/").rsplit("/", 1)[-1],
+        "series_title": anime["title"],
+        "series_episodes": anime["episodes"],
+        "my_watched_episodes": anime["episodes_watched"],
+        "my_score": anime["score"] if anime["score"] else 0,
+        "my_status": anime["status"],
+        "my_times_watched": times_watched,
+        "times_watched": anime["times_watched"],
+    }
+
+
+def export_list(user_id: int, export_format: str) -> Iterator[str]:
+    rows = map(export_row, list_repository.iterate_export_data(user_id))
+
+    if export_format == "xml":
+        yield '<?xml version="1.0" encoding="UTF-8" ?>\n<myanimelist>\n'
+        for row in rows:
+            fields = "".join(
+                f"\t\t<{key}>{escape(str(value))}</{key}>\n"
+                for key, value in row.items()
+            )
+            yield f"\t<anime>\n{fields}\t</anime>\n"
+        yield "</myanimelist>\n"
+
+    elif export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            writer.writerow(row.values())
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    else:
+        for row in rows:
+            yield json.dumps(row) + "\n"
@@ -2,6 +2,7 @@ import string
 from secrets import token_hex
 
 from flask import Response, abort, session
+from werkzeug.security import check_password_hash, generate_password_hash
 
 from repositories import user_repository
 
@@ -55,7 +56,8 @@ def check_register(username: str, password1: str, password2: str) -> list:
 def register(username: str, password1: str, password2: str) -> list:
     errors = check_register(username, password1, password2)
     if not errors:
-        user_id = user_repository.add_user(username, password1)
+        password_hash = generate_password_hash(password1)
+        user_id = user_repository.add_user(username, password_hash)
         session["user_id"] = user_id
         session["username"] = username
         session["show_hidden"] = False
@@ -65,13 +67,14 @@ def register(username: str, password1: str, password2: str) -> list:
 
 
 def login(username: str, password: str) -> bool:
-    if user_repository.username_exists(username) and user_repository.check_password(
-        username, password
-    ):
-        user_id, show_hidden = user_repository.get_user_data(username)
-        session["user_id"] = user_id
-        session["username"] = username
-        session["show_hidden"] = show_hidden
-        session["csrf_token"] = token_hex(16)
-        return True
-    return False
+    data = user_repository.get_login_data(username)
+    if not data:
+        return False
+    user_id, show_hidden, password_hash = data
+    if not check_password_hash(password_hash, password):
+        return False
+    session["user_id"] = user_id
+    session["username"] = username
+    session["show_hidden"] = show_hidden
+    session["csrf_token"] = token_hex(16)
+    return True
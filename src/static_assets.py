@@ -0,0 +1,124 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import Flask, Response, abort, request, send_from_directory
+
+# "flask build-assets" copies the files in static/ to static/build/ with a
+# content hash in the name and writes gzip and brotli versions next to them.
+# Templates link to assets through asset(), which uses the hashed name when a
+# build exists, so the files can be cached forever. HTML and JSON responses are
+# gzipped.
+
+BUILD_DIR = "build"
+MANIFEST = "manifest.json"
+MIN_COMPRESS_SIZE = 1024
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def build(static_folder: str) -> dict:
+    build_folder = os.path.join(static_folder, BUILD_DIR)
+    os.makedirs(build_folder, exist_ok=True)
+    manifest = {}
+    for name in sorted(os.listdir(static_folder)):
+        path = os.path.join(static_folder, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, "rb") as file:
+            data = file.read()
+        stem, extension = os.path.splitext(name)
+        built_name = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}"
+        built_path = os.path.join(build_folder, built_name)
+        with open(built_path, "wb") as file:
+            file.write(data)
+        with open(f"{built_path}.gz", "wb") as file:
+            file.write(gzip.compress(data, 9))
+        if brotli:
+            with open(f"{built_path}.br", "wb") as file:
+                file.write(brotli.compress(data, quality=11))
+        manifest[name] = f"{BUILD_DIR}/{built_name}"
+
+    with open(os.path.join(build_folder, MANIFEST), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def load_manifest(static_folder: str) -> dict:
+    try:
+        with open(
+            os.path.join(static_folder, BUILD_DIR, MANIFEST), "r", encoding="utf-8"
+        ) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def send_built_asset(app: Flask, filename: str) -> Response:
+    folder = os.path.join(app.static_folder, BUILD_DIR)
+    if not os.path.isfile(os.path.join(folder, filename)):
+        abort(404)
+
+    encoding = None
+    for name, extension in (("br", ".br"), ("gzip", ".gz")):
+        if request.accept_encodings[name] > 0 and os.path.isfile(
+            os.path.join(folder, filename + extension)
+        ):
+            encoding = name
+            filename += extension
+            break
+
+    mimetype = mimetypes.guess_type(
+        filename.rsplit(".", 1)[0] if encoding else filename
+    )
+    response = send_from_directory(folder, filename, mimetype=mimetype[0])
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+
+def compress_response(response: Response) -> Response:
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or response.content_encoding
+        or response.mimetype not in ("text/html", "application/json")
+        or request.accept_encodings["gzip"] <= 0
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+    response.set_data(gzip.compress(data, 6))
+    response.content_encoding = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def init_app(app: Flask) -> None:
+    manifest = load_manifest(app.static_folder)
+
+    @app.template_global("asset")
+    def asset(name: str) -> str:
+        return f"{app.static_url_path}/{manifest.get(name, name)}"
+
+    @app.route(f"{app.static_url_path}/{BUILD_DIR}/<path:filename>")
+    def built_asset(filename: str) -> Response:
+        return send_built_asset(app, filename)
+
+    app.after_request(compress_response)
+
+    @app.cli.command("build-assets")
+    def build_assets_command() -> None:
+        built = build(app.static_folder)
+        print(f"Built {len(built)} assets")
+        if not brotli:
+            print("Brotli is not installed, only gzip versions were written")
@@ -6,11 +6,66 @@ def start(ctx):
     ctx.run("cd src && flask run", pty=True)
 
 
+@task
+def start_api(ctx):
+    ctx.run("uvicorn --app-dir src --env-file .env --port 5001 asgi:app", pty=True)
+
+
+@task
+def build_assets(ctx):
+    ctx.run("cd src && flask build-assets", pty=True)
+
+
 @task
 def lint(ctx):
     ctx.run("pylint src", pty=True)
 
 
+@task
+def test(ctx):
+    ctx.run("pytest", pty=True)
+
+
 @task
 def initialize_database(ctx):
-    ctx.run("cd src && INIT=True flask run", pty=True)
+    ctx.run("cd src && flask init-db", pty=True)
+
+
+@task
+def rebuild_stats(ctx):
+    ctx.run("cd src && flask rebuild-stats", pty=True)
+
+
+@task
+def benchmark_search(ctx):
+    ctx.run("cd src && SEARCH_INDEX=True python benchmark_search.py", pty=True)
+
+
+@task
+def benchmark_startup(ctx):
+    ctx.run("cd src && python benchmark_startup.py", pty=True)
+
+
+@task
+def benchmark_list_partitions(ctx, partitions=16, steps="1,2,4,8"):
+    ctx.run(
+        "cd src && python benchmark_list_partitions.py"
+        f" --partitions {partitions} --steps {steps}",
+        pty=True,
+    )
+
+
+@task
+def check_query_plans(ctx, update=False):
+    update_flag = " --update" if update else ""
+    ctx.run(f"cd src && python check_query_plans.py{update_flag}", pty=True)
+
+
+@task
+def export_snapshot(ctx):
+    ctx.run("cd src && python export_snapshot.py", pty=True)
+
+
+@task
+def report(ctx, name, limit=50):
+    ctx.run(f"cd src && python analytics.py {name} --limit {limit}", pty=True)
@@ -0,0 +1,140 @@
+import os
+
+import pytest
+
+# The search index should find and order anime like the SQL it replaces. The
+# catalog below is loaded into the database in TEST_DATABASE_URL, which is
+# emptied first, so it must not be the production database.
+
+if not os.getenv("TEST_DATABASE_URL"):
+    pytest.skip("Set TEST_DATABASE_URL to a scratch database", allow_module_level=True)
+os.environ["DATABASE_URL"] = os.environ["TEST_DATABASE_URL"]
+
+# pylint: disable=wrong-import-position
+from flask import session
+
+import init_db
+import search_index
+from app import create_app
+from database import database
+from repositories import anime_repository, initialization_repository
+
+SOURCE_DIRECTORY = os.path.join(os.path.dirname(__file__), "..", "src")
+
+ANIME = [
+    (1, "Naruto", False, ["Naruto TV", "The Naruto Movie"], ["action", "ninja"]),
+    (2, "Abc Naruto", False, [], ["comedy"]),
+    (3, "Shippuden", False, ["Naruto Shippuden"], ["action", "ninja"]),
+    (4, "Hidden Naruto", True, [], ["action"]),
+    (5, "Bleach", False, ["Bleach TV"], ["action"]),
+    (6, "Monster", False, [], ["drama"]),
+    (7, "Mushishi", False, ["Mushi-Shi"], ["drama", "iyashikei"]),
+    (8, "Yuru Camp", False, ["Laid-Back Camp"], ["comedy", "iyashikei"]),
+]
+# Anime stats, so the pages are ordered by more than the title
+STATS = [(1, 40, 5, 5), (3, 40, 5, 5), (5, 21, 3, 3), (6, 9, 1, 2)]
+QUERIES = ["naru", "NARU", "to", "shi", "camp", "tv", "e", "zzz"]
+
+
+@pytest.fixture(scope="module")
+def index():
+    # schema.sql is read relative to the source directory
+    directory = os.getcwd()
+    os.chdir(SOURCE_DIRECTORY)
+    try:
+        app = create_app()
+        app.config["RESPONSE_CACHE"] = False
+        with app.test_request_context():
+            initialization_repository.init_tables()
+            initialization_repository.copy_rows(
+                "anime",
+                init_db.ANIME_COLUMNS,
+                init_db.to_csv(
+                    [
+                        (
+                            i,
+                            title,
+                            12,
+                            f"https://myanimelist.net/anime/{i}",
+                            "",
+                            "",
+                            hidden,
+                        )
+                        for i, title, hidden, *_ in ANIME
+                    ]
+                ),
+            )
+            initialization_repository.copy_rows(
+                "synonyms",
+                ("anime_id", "synonym"),
+                init_db.to_csv(
+                    [
+                        (i, synonym)
+                        for i, *_, synonyms, _ in ANIME
+                        for synonym in synonyms
+                    ]
+                ),
+            )
+            initialization_repository.copy_rows(
+                "tags",
+                ("anime_id", "tag"),
+                init_db.to_csv([(i, tag) for i, *_, tags in ANIME for tag in tags]),
+            )
+            initialization_repository.copy_rows(
+                "anime_stats",
+                ("anime_id", "score_sum", "score_count", "list_count"),
+                init_db.to_csv(STATS),
+            )
+            initialization_repository.commit()
+            yield search_index.load(None)
+    finally:
+        os.chdir(directory)
+
+
+def sql_page(query: str, tag: str, show_hidden: bool) -> list:
+    sql = anime_repository.TOP_ANIME_TAG_SQL if tag else anime_repository.TOP_ANIME_SQL
+    parameters = {
+        "offset": 0,
+        "query": f"%{query}%",
+        "tag": tag,
+        "show_hidden": show_hidden,
+    }
+    return [row[0] for row in database.session.execute(sql, parameters)]
+
+
+def index_page(index, query: str, tags: list, show_hidden: bool) -> list:
+    anime_ids = index.ids(index.filter(query, tags, [], [], show_hidden))
+    sql = anime_repository.TOP_ANIME_BY_IDS_SQL
+    parameters = {"offset": 0, "anime_ids": anime_ids}
+    return [row[0] for row in database.session.execute(sql, parameters)]
+
+
+@pytest.mark.parametrize("show_hidden", [False, True])
+@pytest.mark.parametrize("query", QUERIES + [""])
+def test_search_matches_sql(index, query, show_hidden):
+    assert index_page(index, query, [], show_hidden) == sql_page(query, "", show_hidden)
+
+
+@pytest.mark.parametrize("tag", ["action", "iyashikei", "missing"])
+@pytest.mark.parametrize("query", ["naru", "", "camp"])
+def test_tag_filter_matches_sql(index, query, tag):
+    assert index_page(index, query, [tag], False) == sql_page(query, tag, False)
+
+
+def test_tag_filters_combine(index):
+    bitmap = index.filter("", ["action"], ["ninja", "comedy"], ["drama"], False)
+    assert sorted(index.ids(bitmap)) == [1, 3]
+
+
+@pytest.mark.parametrize("show_hidden", [False, True])
+@pytest.mark.parametrize("query", QUERIES)
+def test_autocomplete_matches_sql(index, query, show_hidden):
+    session["show_hidden"] = show_hidden
+    assert index.autocomplete(query, show_hidden) == anime_repository.autocomplete(
+        query
+    )
+
+
+def test_autocomplete_lists_name_prefixes_first(index):
+    titles = [anime["title"] for anime in index.autocomplete("naru", False)]
+    assert titles == ["Naruto", "Shippuden", "Abc Naruto"]